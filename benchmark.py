@@ -0,0 +1,658 @@
+#!/usr/bin/env python3
+
+"""
+Offline benchmarks for the dashboard pipeline.
+Uses the recorded responses in ./fixtures and a stand-in
+epaper driver, no network or panel needed
+
+    python benchmark.py
+    python benchmark.py --json bench.json bench_make_display
+"""
+
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+import timeit
+import types
+from datetime import date
+from types import SimpleNamespace
+
+import requests
+
+## keys.py holds the API keys and isn't needed offline
+if "keys" not in sys.modules:
+    try:
+        import keys
+    except ImportError:
+        sys.modules["keys"] = types.ModuleType("keys")
+
+from dashboard_data import *
+import http_client
+import response_cache
+import frame_state
+import metrics
+import snapshot_store
+
+fixture_dir = "./fixtures"
+repeats = 5
+
+## every timing taken, for --json
+results = []
+
+
+def bench(func, number):
+    """
+    Return the best per-call time of func in milliseconds
+    """
+    func()
+    times = timeit.repeat(func, number=number, repeat=repeats)
+    return min(times) / number * 1000
+
+
+def report(name, timings, compare=True, skipped=None):
+    """
+    Print timings for one benchmark, the first entry is the
+    baseline the others are compared to. skipped is
+    {case: reason} for cases that couldn't run
+    """
+    baseline = list(timings.values())[0]
+    print(name)
+    for label, ms in timings.items():
+        if compare:
+            print("    {:<28} {:9.3f} ms  {:5.2f}x".format(label, ms, baseline/ms))
+        else:
+            print("    {:<28} {:9.3f} ms".format(label, ms))
+        results.append({"benchmark": name, "case": label, "ms": round(ms, 4)})
+    for label, reason in (skipped or {}).items():
+        print("    {:<28} skipped: {}".format(label, reason))
+        results.append({"benchmark": name, "case": label, "skipped": reason})
+
+
+def load_fixture(name):
+    with open(fixture_dir+"/"+name, encoding="utf-8") as f:
+        return f.read()
+
+
+##~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+## STAND-IN EPAPER DRIVER
+## Same interface as the Waveshare epd7in3f EPD, it only
+## counts what would have been sent to the panel
+
+class StandInEPD:
+    width = 800
+    height = 480
+
+    ## the driver's colour constants are BGR
+    BLACK = 0x000000
+    WHITE = 0xffffff
+    GREEN = 0x00ff00
+    BLUE = 0xff0000
+    RED = 0x0000ff
+    YELLOW = 0x00ffff
+    ORANGE = 0x0080ff
+
+    def __init__(self):
+        self.frames = 0
+
+    def init(self):
+        pass
+
+    def Clear(self):
+        pass
+
+    def sleep(self):
+        pass
+
+    def display(self, buf):
+        assert len(buf) == self.width * self.height // 2
+        self.frames += 1
+
+    def getbuffer(self, image):
+        return reference_getbuffer(image, self.width, self.height)
+
+
+def stand_in_epaper():
+    """
+    Module standing in for the waveshare-epaper package
+    """
+    module = types.ModuleType("epaper")
+    epdconfig = SimpleNamespace(module_exit=lambda cleanup=False: None)
+    module.epaper = lambda model: SimpleNamespace(EPD=StandInEPD, epdconfig=epdconfig)
+    return module
+
+if "epaper" not in sys.modules:
+    try:
+        import epaper
+    except ImportError:
+        sys.modules["epaper"] = stand_in_epaper()
+
+
+##~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+## RECORDED RESPONSES
+## Every request the dashboard makes is answered from
+## ./fixtures, matched on host and path
+
+fixture_routes = [
+    ("www.google.com", None),
+    ("api.openweathermap.org", "onecall.json"),
+    (airnow_zipsite_current, "airnow_current.json"),
+    (airnow_zipsite_forecast, "airnow_forecast.json"),
+    ("www.houstonhealth.org", "pollen_medium.html"),
+]
+
+
+def rebased_aq_forecast():
+    """
+    The recorded AirNow forecast with its dates moved so
+    it was issued today, tomorrow's forecast is what's drawn
+    """
+    records = json.loads(load_fixture("airnow_forecast.json"))
+    issued = date.fromisoformat(records[0]["DateIssue"].strip())
+    shift = date.today() - issued
+    for record in records:
+        for field in ["DateIssue", "DateForecast"]:
+            day = date.fromisoformat(record[field].strip()) + shift
+            record[field] = str(day) + " "
+    return records
+
+
+def fixture_body(name):
+    if name is None:
+        return ""
+    if name == "airnow_forecast.json":
+        return json.dumps(rebased_aq_forecast())
+    return load_fixture(name)
+
+
+def fixture_response(url):
+    """
+    requests.Response carrying the recorded body for url
+    """
+    response = requests.Response()
+    response.url = url
+    response.encoding = "utf-8"
+    response.status_code = 404
+    response._content = b""
+    for route, name in fixture_routes:
+        if route in url:
+            response.status_code = 200
+            response._content = fixture_body(name).encode("utf-8")
+            break
+    response.raw = io.BytesIO(response._content)
+    return response
+
+
+class FixtureSession:
+    """
+    Answers in place of the pooled sessions in http_client
+    """
+    def get(self, url, **kwargs):
+        return fixture_response(url)
+
+    def head(self, url, **kwargs):
+        return fixture_response(url)
+
+    def close(self):
+        pass
+
+
+@contextlib.contextmanager
+def offline():
+    """
+    Serve HTTP from the fixtures and keep the response cache
+    and display state in a scratch directory
+    """
+    saved = (http_client.get_session, response_cache.cache_dir,
+             frame_state.display_state_path, metrics.metrics_log_path,
+             metrics.prometheus_textfile_path, snapshot_store.snapshot_path)
+    session = FixtureSession()
+    with tempfile.TemporaryDirectory() as scratch:
+        http_client.get_session = lambda url: session
+        response_cache.cache_dir = os.path.join(scratch, "cache")
+        os.makedirs(response_cache.cache_dir)
+        frame_state.display_state_path = os.path.join(scratch, "display_state.json")
+        metrics.metrics_log_path = os.path.join(scratch, "refresh_metrics.jsonl")
+        metrics.prometheus_textfile_path = os.path.join(scratch, "epaper_dashboard.prom")
+        snapshot_store.snapshot_path = os.path.join(scratch, "snapshots.json")
+        snapshot_store._snapshots.clear()
+        try:
+            yield scratch
+        finally:
+            (http_client.get_session, response_cache.cache_dir,
+             frame_state.display_state_path, metrics.metrics_log_path,
+             metrics.prometheus_textfile_path, snapshot_store.snapshot_path) = saved
+            snapshot_store._snapshots.clear()
+            snapshot_store._loaded = False
+
+
+def clear_response_cache():
+    for name in os.listdir(response_cache.cache_dir):
+        os.remove(os.path.join(response_cache.cache_dir, name))
+
+
+def fixture_payloads():
+    """
+    Payloads as fetch_dashboard_data returns them, built
+    from the recorded responses
+    """
+    return {
+        "weather": json.loads(load_fixture("onecall.json")),
+        "pollen": {"levels": {r.type: r.level for r in parse_pollen_page(load_fixture("pollen_medium.html"))},
+                   "date": str(date.today()), "yesterday": False},
+        "air_quality": {"current": json.loads(load_fixture("airnow_current.json")),
+                        "forecast": rebased_aq_forecast()},
+    }
+
+
+##~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+## WEATHER PARSING
+
+def bench_weather_decode(number=200):
+    """
+    Parsing the onecall payload three times (once per
+    extractor) versus once into a WeatherSnapshot
+    """
+    with open(fixture_dir+"/onecall.json") as f:
+        response = SimpleNamespace(text=f.read())
+
+    def triple_decode():
+        for _ in range(3):
+            json.loads(response.text)
+
+    def single_decode():
+        parse_weather(response)
+
+    def extract_triple():
+        current_conditions(parse_weather(response))
+        hourly_forecast(parse_weather(response), hours=8)
+        daily_forecast(parse_weather(response), days=5)
+
+    def extract_single():
+        snapshot = parse_weather(response)
+        current_conditions(snapshot)
+        hourly_forecast(snapshot, hours=8)
+        daily_forecast(snapshot, days=5)
+
+    report("weather decode", {
+        "json.loads x3": bench(triple_decode, number),
+        "parse_weather x1": bench(single_decode, number),
+        "extractors, decode x3": bench(extract_triple, number),
+        "extractors, decode x1": bench(extract_single, number),
+    })
+
+
+def bench_source_parsing(number=200):
+    """
+    Each step of turning the fetched payloads into display data
+    """
+    payloads = fixture_payloads()
+    snapshot = decode_weather(payloads["weather"])
+
+    report("source parsing", {
+        "current_conditions": bench(lambda: current_conditions(snapshot), number),
+        "hourly_forecast": bench(lambda: hourly_forecast(snapshot, hours=8), number),
+        "daily_forecast": bench(lambda: daily_forecast(snapshot, days=5), number),
+        "build_weather_data": bench(lambda: build_weather_data(payloads["weather"]), number),
+        "build_air_quality": bench(lambda: build_air_quality(payloads["air_quality"]), number),
+    }, compare=False)
+
+
+##~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+## POLLEN PARSING
+
+pollen_fixtures = ["pollen_medium.html", "pollen_extremely_heavy.html"]
+
+
+def legacy_pollen_parse(content):
+    """
+    The original BeautifulSoup pollen parser, kept for comparison
+    """
+    from bs4 import BeautifulSoup
+    soup = BeautifulSoup(content, "html.parser")
+    tmp = soup.find_all("p", class_="text-align-center")
+    
+    pollen_data = {}
+    for i in tmp:
+        tmp_data = str(i)[37:].replace("</strong><br/><strong>", " ").split()
+        pollen_type = ' '.join([tmp_data[0], tmp_data[1]])
+        pollen_level = tmp_data[2]
+        if tmp_data[3].lower() == "heavy": #needed for houston
+            pollen_level = "extremely heavy"
+        pollen_type = pollen_type.replace("<br/>", "")
+        pollen_level = pollen_level.replace("<br/>", "")
+        pollen_data[pollen_type] = pollen_level
+
+    return pollen_data
+
+
+def bench_pollen_parse(number=20):
+    """
+    Full BeautifulSoup tree versus the targeted parser.
+    bs4 is only needed here, see requirements-bench.txt
+    """
+    for fixture in pollen_fixtures:
+        with open(fixture_dir+"/"+fixture, "rb") as f:
+            content = f.read()
+        html = content.decode("utf-8")
+
+        ## both parsers have to agree before timing them
+        records = parse_pollen_page(html)
+        results = {}
+        skipped = {}
+        try:
+            legacy = legacy_pollen_parse(content)
+        except ImportError:
+            skipped["BeautifulSoup"] = "bs4 not installed"
+        else:
+            assert {r.type: r.level for r in records} == \
+                {k: v.lower() for k, v in legacy.items()}
+            results["BeautifulSoup"] = bench(lambda: legacy_pollen_parse(content), number)
+        results["parse_pollen_page"] = bench(lambda: parse_pollen_page(html), number)
+        report("pollen parse, " + fixture, results, skipped=skipped)
+
+
+##~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+## FETCHING
+
+def bench_source_fetch(number=20):
+    """
+    Each source's fetch through the response cache, answered
+    from the fixtures. Cold starts from an empty cache
+    """
+    sources = {
+        "weather": lambda: get_weather_payload(weather_api_key="", 
+                                               latitude="29.8068", longitude="-95.4181"),
+        "pollen": get_pollen_data,
+        "air quality": lambda: get_aq_records(airnow_api_key=""),
+    }
+
+    timings = {}
+    with offline():
+        for name, fetch in sources.items():
+            def cold():
+                clear_response_cache()
+                fetch()
+            assert fetch()
+            timings[name + ", cold"] = bench(cold, number)
+            timings[name + ", cached"] = bench(fetch, number)
+    report("source fetch", timings, compare=False)
+
+
+##~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+## RENDERING
+
+def fixture_dashboard_data():
+    """
+    Dashboard data as parse_dashboard_data would return it,
+    built from the recorded fixtures
+    """
+    return parse_dashboard_data(fixture_payloads())
+
+
+def bench_static_layer(number=20):
+    """
+    Rendering the whole frame from scratch versus starting
+    from a copy of the cached static layer
+    """
+    import display
+    display.preload_icons(display.render_mode)
+    data = fixture_dashboard_data()
+
+    def uncached():
+        display._static_layer = None
+        display._tile_cache.clear()
+        display.render_dashboard(data, debug=True)
+
+    def cached():
+        display._tile_cache.clear()
+        display.render_dashboard(data, debug=True)
+
+    report("render dashboard", {
+        "static layer redrawn": bench(uncached, number),
+        "static layer cached": bench(cached, number),
+    })
+
+
+def bench_quadrant_tiles(number=20):
+    """
+    Re-rendering every quadrant versus only the one whose
+    data changed, here the hourly forecast
+    """
+    import display
+    display.preload_icons(display.render_mode)
+    data = fixture_dashboard_data()
+    hourly = data["weather"]["hourly"]
+    shifted = hourly[1:] + hourly[:1]
+
+    def all_quadrants():
+        display._tile_cache.clear()
+        display.render_dashboard(data, debug=True)
+
+    def forecast_changed():
+        data["weather"]["hourly"] = shifted if data["weather"]["hourly"] is hourly else hourly
+        display.render_dashboard(data, debug=True)
+
+    def nothing_changed():
+        display.render_dashboard(data, debug=True)
+
+    report("quadrant tiles", {
+        "all quadrants rendered": bench(all_quadrants, number),
+        "forecast re-rendered": bench(forecast_changed, number),
+        "all tiles cached": bench(nothing_changed, number),
+    })
+
+
+def bench_text_cache(number=20):
+    """
+    Rendering every quadrant with plain draw.text versus
+    pasting text runs from the cache
+    """
+    import display
+    import text_cache
+    display.preload_icons(display.render_mode)
+    data = fixture_dashboard_data()
+
+    def render():
+        display._tile_cache.clear()
+        return display.render_dashboard(data, debug=True)
+
+    def cold():
+        text_cache.clear_text_cache()
+        render()
+
+    text_cache.text_cache_enabled = False
+    try:
+        plain_frame = render().tobytes()
+        plain = bench(render, number)
+    finally:
+        text_cache.text_cache_enabled = True
+    assert render().tobytes() == plain_frame
+
+    report("text cache, all quadrants", {
+        "draw.text": plain,
+        "text cache, cold": bench(cold, number),
+        "text cache, warm": bench(render, number),
+    })
+
+
+##~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+## BUFFER PACKING
+
+def reference_getbuffer(image, width=800, height=480):
+    """
+    The Waveshare epd7in3f getbuffer, copied so it can be
+    timed without the driver installed
+    """
+    from PIL import Image
+    pal_image = Image.new("P", (1,1))
+    pal_image.putpalette( (0,0,0,  255,255,255,  0,255,0,   0,0,255,  255,0,0,  255,255,0, 255,128,0) + (0,0,0)*249)
+
+    image_7color = image.convert("RGB").quantize(palette=pal_image)
+    buf_7color = bytearray(image_7color.tobytes('raw'))
+
+    buf = [0x00] * int(width * height / 2)
+    idx = 0
+    for i in range(0, len(buf_7color), 2):
+        buf[idx] = (buf_7color[i] << 4) + buf_7color[i+1]
+        idx += 1
+        
+    return buf
+
+
+def bench_buffer_packing(number=5):
+    """
+    getbuffer versus the numpy packer, on the rendered frame
+    and on the same frame as RGB
+    """
+    import display
+    from framebuffer import pack_frame, numpy_available
+    if not numpy_available():
+        print("buffer packing: numpy not installed, skipped")
+        return
+
+    display.preload_icons(display.render_mode)
+    frame = display.render_dashboard(fixture_dashboard_data(), debug=True)
+    frames = [(frame.mode + " frame", frame)]
+    if frame.mode != "RGB":
+        frames.append(("RGB frame", frame.convert("RGB")))
+
+    for label, image in frames:
+        assert bytes(reference_getbuffer(image)) == bytes(pack_frame(image, 800, 480))
+        report("buffer packing, " + label, {
+            "getbuffer": bench(lambda: reference_getbuffer(image), number),
+            "pack_frame": bench(lambda: pack_frame(image, 800, 480), number),
+        })
+
+
+##~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+## FULL REFRESH
+
+def bench_make_display(number=5):
+    """
+    A whole make_display on the panel path, from the
+    connectivity check to the stand-in EPD
+    """
+    import display
+    display.preload_icons(display.render_mode)
+    profile = display.location_profiles[0]
+    epd = display.profile_sink(profile).open()
+
+    def refresh():
+        with contextlib.redirect_stdout(io.StringIO()):
+            display.make_display(debug=False)
+
+    def cold():
+        clear_response_cache()
+        snapshot_store._snapshots.clear()
+        frame_state.clear_display_state()
+        display._tile_cache.clear()
+        refresh()
+
+    def cached_data():
+        frame_state.clear_display_state()
+        display._tile_cache.clear()
+        refresh()
+
+    with offline():
+        cold()
+        assert epd.frames == 1 and frame_state.load_display_state(profile.name)
+        report("make_display", {
+            "fetch, render, send": bench(cold, number),
+            "cached data, render, send": bench(cached_data, number),
+            "unchanged, skipped": bench(refresh, number),
+        })
+
+
+def bench_profiles(number=3, count=4):
+    """
+    A refresh of several location profiles to file sinks,
+    rendered one after another versus on the render pool.
+    Tiles stay cached, render workers keep their own caches
+    """
+    import display
+    display.preload_icons(display.render_mode)
+    saved = display.location_profiles, display.render_workers
+
+    def refresh():
+        frame_state.clear_display_state()
+        with contextlib.redirect_stdout(io.StringIO()):
+            display.make_display(debug=False)
+
+    timings = {}
+    with offline() as scratch:
+        display.location_profiles = [
+            LocationProfile("site{}".format(i), latitude="29.{}".format(i), longitude="-95.4",
+                            zipcode="77008", sink="file:{}/site{}.png".format(scratch, i))
+            for i in range(count)]
+        try:
+            for label, workers in [("inline", 1), ("pool", None)]:
+                display.render_workers = workers
+                display.stop_render_pool()
+                display.start_render_pool()
+                pool_size = display.render_pool_size()
+                timings["{} profiles, {}".format(count, label)] = bench(refresh, number)
+                assert all(os.path.exists(profile.sink[len("file:"):]) 
+                           for profile in display.location_profiles)
+        finally:
+            display.stop_render_pool()
+            display.location_profiles, display.render_workers = saved
+    ## one CPU resolves the pool to a single worker, rendering inline
+    report("location profiles, pool of {}".format(pool_size), timings)
+
+
+benchmarks = [
+    bench_weather_decode,
+    bench_source_parsing,
+    bench_pollen_parse,
+    bench_source_fetch,
+    bench_static_layer,
+    bench_quadrant_tiles,
+    bench_text_cache,
+    bench_buffer_packing,
+    bench_make_display,
+    bench_profiles,
+]
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def write_results(path):
+    """
+    Save the timings as JSON, to track them from commit to commit
+    """
+    run = {
+        "timestamp": int(time.time()),
+        "commit": git_commit(),
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "repeats": repeats,
+        "results": results,
+    }
+    with open(path, "w") as f:
+        json.dump(run, f, indent=1)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Offline dashboard benchmarks")
+    parser.add_argument("names", nargs="*", help="benchmarks to run, default all")
+    parser.add_argument("--json", metavar="PATH", help="also write the results as JSON")
+    args = parser.parse_args()
+
+    for benchmark in benchmarks:
+        if not args.names or benchmark.__name__ in args.names:
+            benchmark()
+    if args.json:
+        write_results(args.json)
@@ -0,0 +1,46 @@
+#!/usr/bin/env python3
+
+"""
+Build the palette-native icon pack. Every icon is resized
+to every size display.py uses, mapped onto the panel's 7
+colours and written as palette-indexed bytes into a single
+file that icons.py maps into memory at startup
+
+    python build_icon_pack.py
+"""
+
+import json
+import struct
+from icons import icon_manifest, load_icon, icon_pack_path, icon_pack_magic, icon_pack_key
+from palette import palette_data, to_panel_colors
+
+
+def build_icon_pack(path=icon_pack_path):
+    """
+    Write every (icon, size) in icon_manifest to the pack
+    """
+    index = {}
+    blobs = []
+    offset = 0
+    for size, icon_paths in icon_manifest.items():
+        for icon_path in icon_paths:
+            icon = to_panel_colors(load_icon(icon_path, size))
+            data = icon.tobytes()
+            index[icon_pack_key(icon_path, size)] = [offset, size[0], size[1]]
+            blobs.append(data)
+            offset += len(data)
+
+    header = json.dumps({"palette": palette_data(), "icons": index}).encode()
+    with open(path, "wb") as f:
+        f.write(icon_pack_magic)
+        f.write(struct.pack("<I", len(header)))
+        f.write(header)
+        for data in blobs:
+            f.write(data)
+
+    return len(index), offset
+
+
+if __name__ == "__main__":
+    count, size = build_icon_pack()
+    print("wrote {} icons, {} bytes of pixels, to {}".format(count, size, icon_pack_path))
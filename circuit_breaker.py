@@ -0,0 +1,121 @@
+import logging
+import threading
+import time
+from collections import deque
+
+##~~~~~~~~~~~~~~~~~
+## CIRCUIT BREAKERS
+## One breaker per data source. After failure_threshold failures
+## in a row, or once failure_rate_threshold of the last
+## failure_window calls failed, the breaker opens and calls fail
+## straight away instead of waiting out timeouts. When the open
+## period is over one probe call is let through, success closes
+## the breaker and failure reopens it for twice as long
+
+failure_threshold = 3
+failure_window = 10
+failure_rate_threshold = 0.5
+open_seconds = 60
+max_open_seconds = 60*60
+
+_breakers = {}
+_breakers_lock = threading.Lock()
+
+
+class CircuitOpenError(Exception):
+    """
+    Raised instead of calling a source whose breaker is open
+    """
+
+
+class CircuitBreaker:
+
+    def __init__(self, name):
+        self.name = name
+        self.state = "closed"
+        self.failures = 0
+        self.outcomes = deque(maxlen=failure_window)
+        self.open_for = open_seconds
+        self.open_until = 0
+        self.lock = threading.Lock()
+
+    def allow(self):
+        """
+        Whether a call may go ahead, moving an open breaker
+        to half-open once its open period is over
+        """
+        with self.lock:
+            if self.state == "closed":
+                return True
+            if self.state == "open" and time.time() >= self.open_until:
+                self.state = "half-open"
+                logging.info("breaker %s half-open, probing", self.name)
+                return True
+            ## one probe at a time while half-open
+            return False
+
+    def record_success(self):
+        with self.lock:
+            self.failures = 0
+            self.outcomes.append(True)
+            if self.state != "closed":
+                logging.warning("breaker %s closed, source recovered", self.name)
+                self.state = "closed"
+                self.open_for = open_seconds
+
+    def record_failure(self):
+        with self.lock:
+            self.failures += 1
+            self.outcomes.append(False)
+            if self.state == "half-open":
+                self.open_for = min(self.open_for * 2, max_open_seconds)
+                self.trip("probe failed")
+            elif self.state == "closed":
+                error_rate = self.outcomes.count(False) / len(self.outcomes)
+                if self.failures >= failure_threshold:
+                    self.trip("{} failures in a row".format(self.failures))
+                elif len(self.outcomes) == failure_window and error_rate >= failure_rate_threshold:
+                    self.trip("{:.0%} of the last {} calls failed".format(error_rate, failure_window))
+
+    def trip(self, reason):
+        self.state = "open"
+        self.open_until = time.time() + self.open_for
+        logging.warning("breaker %s open for %d s, %s", self.name, self.open_for, reason)
+
+
+def get_breaker(name):
+    """
+    Return the breaker for a source, creating it on first use
+    """
+    with _breakers_lock:
+        breaker = _breakers.get(name)
+        if breaker is None:
+            breaker = CircuitBreaker(name)
+            _breakers[name] = breaker
+    return breaker
+
+
+def call_with_breaker(name, func, *args, **kwargs):
+    """
+    Call func through the named source's breaker, raising
+    CircuitOpenError without calling it while the breaker is open
+    """
+    breaker = get_breaker(name)
+    if not breaker.allow():
+        raise CircuitOpenError("{} breaker is {}, retry after {}".format(
+            name, breaker.state, time.strftime("%H:%M:%S", time.localtime(breaker.open_until))))
+    try:
+        result = func(*args, **kwargs)
+    except Exception:
+        breaker.record_failure()
+        raise
+    breaker.record_success()
+    return result
+
+
+def breaker_states():
+    """
+    State of every breaker by source name, for the logs
+    """
+    with _breakers_lock:
+        return {name: breaker.state for name, breaker in _breakers.items()}
@@ -1,130 +1,77 @@
-import requests
 from datetime import datetime, timedelta, date
-from bs4 import BeautifulSoup
+from html.parser import HTMLParser
+from collections import namedtuple
+import re
+from http_client import http_get, http_head
+from response_cache import cached_fetch, carry_report, read_entry, write_entry, until_next_business_day
+from functools import partial
 import json
+import time
+import logging
+import concurrent.futures
+from dataclasses import dataclass
+from palette import panel_colors, epap_model
+from icons import curr_weather_icons
+from metrics import timed, carry_timing
+from circuit_breaker import call_with_breaker, breaker_states
 from keys import *
 
-epap_model = "epd7in3f"
+
+## Cache lifetimes per source, in seconds. Past its ttl an
+## entry is still served for stale_ttl while it's refreshed
+weather_ttl = 10*60
+weather_stale_ttl = 10*60
+aq_ttl = 60*60
+aq_stale_ttl = 30*60
+## pollen's ttl depends on the page it came from, see pollen_expiry
+pollen_stale_ttl = 12*60*60
+
+## Request timeouts per source, (connect, read) in seconds.
+## Connecting fails fast, a source that keeps failing is cut
+## off by its circuit breaker (circuit_breaker.py) and served
+## from the cache until a probe gets through
+weather_timeout = (5, 20)
+aq_timeout = (5, 15)
 
 ## color coding functions
-def pollen_color(pollen_level, debug=False):
-    if debug:
-        if pollen_level.lower()=="low":
-            color="green"
-        elif pollen_level.lower()=="medium":
-            color="yellow"
-        elif pollen_level.lower()=="heavy":
-            color="red"
-        elif pollen_level.lower()=="extremely heavy":
-            color="red"
-        else:
-            color="white"
-    else:
-        import epaper
-        epd = epaper.epaper(epap_model).EPD()
-        if pollen_level.lower()=="low":
-            color=epd.GREEN
-        elif pollen_level.lower()=="medium":
-            color=epd.YELLOW
-        elif pollen_level.lower()=="heavy":
-            color=epd.RED
-        elif pollen_level.lower()=="extremely heavy":
-            color=epd.RED
-        else:
-            color=epd.WHITE
-            
-    return color
-
-
-def aq_color(aq_code, debug=False):
-    if debug:
-        if aq_code is None:
-            color="white"
-        elif aq_code==1:
-            color="green"
-        elif aq_code==2:
-            color="yellow"
-        elif aq_code==3:
-            color="orange"
-        elif aq_code>=4:
-            color="red"
-        else:
-            color="white"
-    else:
-        import epaper
-        epd = epaper.epaper(epap_model).EPD()
-        if aq_code is None:
-            color=epd.WHITE
-        elif aq_code==1:
-            color=epd.GREEN
-        elif aq_code==2:
-            color=epd.YELLOW
-        elif aq_code==3:
-            color=epd.ORANGE
-        elif aq_code>=4:
-            color=epd.RED
-        else:
-            color=epd.WHITE
+## Thresholds are lookup tables of colour names, resolved to
+## debug, panel or palette index colours through palette.panel_colors
+
+pollen_color_table = {
+    "low": "green",
+    "medium": "yellow",
+    "heavy": "red",
+    "extremely heavy": "red",
+}
 
-    return color
+## AirNow category number, 4 and up is red
+aq_color_table = {1: "green", 2: "yellow", 3: "orange", 4: "red"}
 
+## rounded UV index, 8 and up is red
+uvi_color_table = ["green", "green", "green",
+                   "yellow", "yellow", "yellow",
+                   "orange", "orange",
+                   "red"]
 
-def uvi_color(uvi, debug=False):
-    if debug:
-        if uvi is None:
-            return "black"
-        elif uvi<0:
-            return "black"
-        else:
-            pass
-        uvi = round(uvi)
-        if uvi<=2:
-            color="green"
-        elif uvi<=5:
-            color="yellow"
-        elif uvi<=7:
-            color="orange"
-        elif uvi>=8:
-            color="red"
-        else:
-            color="black"
+
+def pollen_color(pollen_level, debug=False, mode="RGB"):
+    name = pollen_color_table.get(pollen_level.lower(), "white")
+    return panel_colors(debug, mode)[name]
+
+
+def aq_color(aq_code, debug=False, mode="RGB"):
+    if aq_code is None:
+        name = "white"
     else:
-        import epaper
-        epd = epaper.epaper(epap_model).EPD()
-        if uvi is None:
-            return epd.BLACK
-        elif uvi<0:
-            return epd.BLACK
-        else:
-            pass
-        uvi = round(uvi)
-        if uvi<=2:
-            color=epd.GREEN
-        elif uvi<=5:
-            color=epd.YELLOW
-        elif uvi<=7:
-            color=epd.ORANGE
-        elif uvi>=8:
-            color=epd.RED
-        else:
-            color=epd.BLACK
-
-    return color
-
-
-## Current weather icons based on weather id
-curr_weather_icons = {
-    "clear": "./icons/sun.bmp",
-    "clear_night": "./icons/night.bmp",
-    "partly cloudy": "./icons/partly_cloudy.bmp",
-    "partly cloudy night": "./icons/partly_cloudy_night.bmp",
-    "mostly cloudy": "./icons/mostly_cloudy.bmp",
-    "light rain": "./icons/light_rain.bmp",
-    "rain": "./icons/rain.bmp",
-    "thunderstorm": "./icons/thunder.bmp",
-    "snow": "./icons/snow.bmp",
-    "atmospheric": "./icons/atm.bmp",
-}
+        name = aq_color_table.get(min(aq_code, 4), "white")
+    return panel_colors(debug, mode)[name]
+
+
+def uvi_color(uvi, debug=False, mode="RGB"):
+    if uvi is None or uvi<0:
+        return panel_colors(debug, mode)["black"]
+    name = uvi_color_table[min(round(uvi), len(uvi_color_table)-1)]
+    return panel_colors(debug, mode)[name]
 
 
 def get_condition_icon(id, is_daytime, daily=False):
@@ -174,11 +121,8 @@ def get_aq_data_current(airnow_api_key, zipcode="77008"):
     payload["zipCode"] = zipcode
     payload["format"] = "JSON"
     payload["api_key"] = airnow_api_key
-    with requests.get(airnow_host+airnow_zipsite_current, params=payload, timeout=30) as response:
-        try:
-            return response
-        except (requests.ConnectionError, requests.Timeout) as exception:
-            return None
+    with http_get(airnow_host+airnow_zipsite_current, params=payload, timeout=aq_timeout) as response:
+        return response
         
 
 def get_aq_data_forecast(airnow_api_key, zipcode="77008"):
@@ -190,164 +134,177 @@ def get_aq_data_forecast(airnow_api_key, zipcode="77008"):
     payload["zipCode"] = zipcode
     payload["format"] = "JSON"
     payload["api_key"] = airnow_api_key
-    with requests.get(airnow_host+airnow_zipsite_forecast, params=payload, timeout=30) as response:
-        try:
-            return response
-        except (requests.ConnectionError, requests.Timeout) as exception:
-            return None
+    with http_get(airnow_host+airnow_zipsite_forecast, params=payload, timeout=aq_timeout) as response:
+        return response
         
 
-def get_ozone_current(response):
+def decode_aq_response(response):
     """
-    Parse the AirNow current air quality API response
-    for Ozone value and level
+    Decode an AirNow API response into its list of records,
+    raising ValueError for a failed or malformed response. An
+    empty list is a valid reply, e.g. no monitor reporting yet
     """
-    ozone_value, ozone_level, ozone_code = None, None, None
-    
-    aq = json.loads(response.text)
-    
-    for i in range(len(aq)):
-        if aq[i]["ParameterName"]=="O3":
-            try:
-                ozone_value = aq[i]["AQI"]
-            except:
-                pass
-            try:
-                ozone_level = aq[i]["Category"]["Name"]
-            except:
-                pass
-            try:
-                ozone_code = aq[i]["Category"]["Number"]
-            except:
-                pass
+    if response.status_code != 200:
+        raise ValueError("AirNow returned HTTP {}".format(response.status_code))
+    records = json.loads(response.text)
+    if not isinstance(records, list):
+        raise ValueError("AirNow reply is not a list of records")
+    return records
 
-    return ozone_value, ozone_level, ozone_code
+
+def fetch_aq_records(fetcher, **kwargs):
+    """
+    Fetch and decode AirNow records with one of the
+    get_aq_data functions
+    """
+    return decode_aq_response(fetcher(**kwargs))
 
 
-def get_particulate_current(response):
+def index_aq_current(records):
     """
-    Parse the AirNow current air quality API response
-    for Particulate 2.5 value and level
+    Index current AirNow observations by ParameterName
+    (O3, PM2.5, PM10, ...)
     """
-    part_value, part_level, part_code = None, None, None
-    
-    aq = json.loads(response.text)
-    
-    for i in range(len(aq)):
-        if aq[i]["ParameterName"]=="PM2.5":
-            try:
-                part_value = aq[i]["AQI"]
-            except:
-                pass
-            try:
-                part_level = aq[i]["Category"]["Name"]
-            except:
-                pass
-            try:
-                part_code = aq[i]["Category"]["Number"]
-            except:
-                pass
+    aq_index = {}
+    for record in records:
+        try:
+            aq_index[record["ParameterName"]] = record
+        except (KeyError, TypeError):
+            pass
+    return aq_index
 
-    return part_value, part_level, part_code
 
+def index_aq_forecast(records):
+    """
+    Index AirNow forecasts by (ParameterName, DateForecast),
+    covering every parameter and every forecast day
+    """
+    aq_index = {}
+    for record in records:
+        try:
+            key = (record["ParameterName"], record["DateForecast"].strip())
+        except (KeyError, TypeError, AttributeError):
+            continue
+        aq_index[key] = record
+    return aq_index
 
-def get_ozone_forecast(response):
+
+def aq_category(record):
     """
-    Parse the AirNow forecasted air quality API response
-    for Ozone value and level
+    Return the AQI value, category name and category
+    number of an AirNow record, None where missing
     """
-    ozone_level, ozone_code = None, None
-    
-    aq = json.loads(response.text)
+    if record is None:
+        return None, None, None
+    category = record.get("Category") or {}
+    aqi = record.get("AQI")
+    if aqi is not None and aqi < 0:
+        ## AirNow reports -1 when no AQI was computed
+        aqi = None
+    return aqi, category.get("Name"), category.get("Number")
 
-    current_time = datetime.now()
-    today = current_time.date()
-    tomorrow = today + timedelta(days=1)
-    
-    for i in range(len(aq)):
-        try:
-            if aq[i]["ParameterName"]=="O3" and aq[i]["DateForecast"]==str(tomorrow):
-                try:
-                    ozone_level = aq[i]["Category"]["Name"]
-                except:
-                    pass
-                try:
-                    ozone_code = aq[i]["Category"]["Number"]
-                except:
-                    pass
-        except KeyError:
-            pass
 
-    return ozone_level, ozone_code
+def get_current_aq(aq_current, parameter):
+    """
+    Look up the current value, level and code for
+    a parameter, e.g. "O3" or "PM2.5"
+    """
+    return aq_category(aq_current.get(parameter))
 
 
-def get_particulate_forecast(response):
+def get_forecast_aq(aq_forecast, parameter, day):
     """
-    Parse the AirNow forecasted air quality API response
-    for Particulate 2.5 value and level
+    Look up the forecasted level and code for a parameter
+    on a given date
     """
-    part_level, part_code = None, None
-    
-    aq = json.loads(response.text)
+    _, level, code = aq_category(aq_forecast.get((parameter, str(day))))
+    return level, code
 
-    current_time = datetime.now()
-    today = current_time.date()
-    tomorrow = today + timedelta(days=1)
-    
-    for i in range(len(aq)):
-        try:
-            if aq[i]["ParameterName"]=="PM2.5" and aq[i]["DateForecast"]==str(tomorrow):
-                try:
-                    part_level = aq[i]["Category"]["Name"]
-                except:
-                    pass
-                try:
-                    part_code = aq[i]["Category"]["Number"]
-                except:
-                    pass
-        except KeyError:
-            pass
 
-    return part_level, part_code
+## AirNow endpoints, each with its own cache entry and breaker
+## per zip code
+aq_endpoints = {
+    "current": get_aq_data_current,
+    "forecast": get_aq_data_forecast,
+}
 
 
-def get_air_quality(**kwargs):
-    """ 
-    Main function to get the current and forecasted air
-    quality, i.e., ozone and particulate levels
+def get_aq_records(**kwargs):
     """
+    Decoded AirNow current and forecast records, from the
+    cache while they are fresh. An endpoint that fails gives
+    no records, only both failing raises
+    """
+    zipcode = kwargs.get("zipcode", "77008")
+
+    def fetch_endpoint(name, fetcher):
+        return cached_fetch("airnow_{}_{}".format(name, zipcode),
+                            partial(call_with_breaker, aq_source_key(zipcode) + " " + name, 
+                                    fetch_aq_records,
+                                    fetcher, **kwargs),
+                            aq_ttl, aq_stale_ttl)
+
+    ## the two AirNow calls are independent, so run them side by side
+    records = {}
+    errors = []
+    with concurrent.futures.ThreadPoolExecutor(max_workers=len(aq_endpoints)) as executor:
+        futures = {name: executor.submit(carry_report(carry_timing(fetch_endpoint)), name, fetcher)
+                   for name, fetcher in aq_endpoints.items()}
+        for name, future in futures.items():
+            try:
+                records[name] = future.result()
+            except Exception as exception:
+                logging.warning("FAIL fetching AirNow %s records: %s", name, exception)
+                records[name] = []
+                errors.append(exception)
+
+    if len(errors) == len(aq_endpoints):
+        raise errors[0]
+    return records
 
+
+def build_air_quality(aq_records):
+    """
+    Index the AirNow records and pick out the current and
+    tomorrow's ozone and particulate codes. The full indexes
+    are returned under "current" and "forecast"
+    """
     air_quality = {
         "ozone_code_current": None,
         "ozone_code_fore": None, 
         "part_code_current": None,
-        "part_code_fore": None
+        "part_code_fore": None,
+        "current": {},
+        "forecast": {},
     }
 
-    response_current = get_aq_data_current(**kwargs)
-    response_forecast = get_aq_data_forecast(**kwargs)
+    aq_current = index_aq_current(aq_records["current"])
+    aq_forecast = index_aq_forecast(aq_records["forecast"])
 
-    if response_current is None and response_forecast is None:
-        return air_quality
-    
-    elif response_current.status_code in [404, 504]:
-        if response_forecast.status_code in [404, 504]:
-            return air_quality
-    
-    else:
-        ## Gathering additional data in case needed in later versions,
-        ## leaving as orphan variables for now
-        oz_val, oz_lev, oz_code = get_ozone_current(response_current)
-        part_val, part_lev, part_code = get_particulate_current(response_current)
-        oz_fore_lev, oz_fore_code = get_ozone_forecast(response_forecast)
-        part_fore_lev, part_fore_code = get_particulate_forecast(response_forecast)
-
-        air_quality["ozone_code_current"] = oz_code
-        air_quality["ozone_code_fore"] = oz_fore_code
-        air_quality["part_code_current"] = part_code
-        air_quality["part_code_fore"] = part_fore_code
-
-        return air_quality
+    tomorrow = date.today() + timedelta(days=1)
+
+    _, _, oz_code = get_current_aq(aq_current, "O3")
+    _, _, part_code = get_current_aq(aq_current, "PM2.5")
+    _, oz_fore_code = get_forecast_aq(aq_forecast, "O3", tomorrow)
+    _, part_fore_code = get_forecast_aq(aq_forecast, "PM2.5", tomorrow)
+
+    air_quality["ozone_code_current"] = oz_code
+    air_quality["ozone_code_fore"] = oz_fore_code
+    air_quality["part_code_current"] = part_code
+    air_quality["part_code_fore"] = part_fore_code
+    air_quality["current"] = aq_current
+    air_quality["forecast"] = aq_forecast
+
+    return air_quality
+
+
+def get_air_quality(**kwargs):
+    """ 
+    Main function to get the current and forecasted air
+    quality, i.e., ozone and particulate levels.
+    Each response is decoded once into an index
+    """
+    return build_air_quality(get_aq_records(**kwargs))
     
 
 ##~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
@@ -365,85 +322,263 @@ def get_last_friday():
     return last_friday
 
 
-def make_payload_addition(use_yesterday=False):
+def pollen_page_date(use_yesterday=False):
     """
-    Create the end tag of the url based on the date.
+    Date of the pollen page to look for, today's or last
+    Friday's on weekends, or yesterday's
     """
+    if use_yesterday:
+        return date.today() - timedelta(days=1)
     if date.today().strftime('%A') in ["Saturday", "Sunday"]:
-        use_date = get_last_friday()
-    else:
-        use_date = date.today()
+        return get_last_friday().date()
+    return date.today()
 
-    if use_yesterday:
-        use_date = date.today() - timedelta(days=1)
+
+def make_payload_addition(use_yesterday=False, template=None):
+    """
+    Create the end tag of the url based on the date.
+    template can rearrange the date fields, e.g.
+    "{day_name}-{month}-{day}{year}"
+    """
+    use_date = pollen_page_date(use_yesterday)
 
     year = str(use_date.year)
     month = use_date.strftime('%B').lower()
     day_name = use_date.strftime('%A').lower()
     day_number = str(use_date.day)
 
+    if template is not None:
+        return template.format(day_name=day_name, month=month, 
+                               day=day_number, year=year)
+
     tmp_lst = [day_name, month, day_number, year]
     payload_addition = "-".join(p for p in tmp_lst)
     
     return payload_addition
 
 
+## Pollen page url parts
+pollen_url_base = "https://www.houstonhealth.org/services/pollen-mold/"
+pollen_payload_base = "houston-pollen-mold-count-"
+pollen_timeout = (5, 20)
+pollen_probe_timeout = (5, 10)
+pollen_fallback_memo = 60*60
+
+## Slug layouts tried when resolving the day's page, in order of
+## preference. The second one is because COH fat fingers the
+## second hyphen. Add any new mistakes to pollen_extra_slugs
+pollen_slug_templates = [
+    "{day_name}-{month}-{day}-{year}",
+    "{day_name}-{month}-{day}{year}",
+]
+pollen_extra_slugs = []
+
+
+def pollen_url_candidates():
+    """
+    Every candidate url for the current pollen page, for
+    today (or last Friday) and then yesterday, per slug layout.
+    Returns (url, is yesterday's page) pairs
+    """
+    candidates = []
+    for template in pollen_slug_templates + pollen_extra_slugs:
+        for use_yesterday in [False, True]:
+            payload_addition = make_payload_addition(use_yesterday=use_yesterday,
+                                                     template=template)
+            url = pollen_url_base + pollen_payload_base + payload_addition
+            if url not in [c[0] for c in candidates]:
+                candidates.append((url, use_yesterday))
+    return candidates
+
+
+def probe_url(url):
+    """
+    Lightweight check that a page exists
+    """
+    import requests
+    try:
+        with http_head(url, timeout=pollen_probe_timeout, allow_redirects=True) as response:
+            return response.status_code == 200
+    except requests.RequestException:
+        return False
+
+
+def end_of_today():
+    """
+    Timestamp of the coming midnight
+    """
+    tomorrow = date.today() + timedelta(days=1)
+    return datetime.combine(tomorrow, datetime.min.time()).timestamp()
+
+
+def resolve_pollen_url(force=False):
+    """
+    Find the url of the current pollen page, returns (url,
+    whether it is yesterday's page). All candidates are probed
+    in parallel and the most preferred one that exists wins.
+    Today's page is remembered until midnight so later
+    refreshes skip resolving, yesterday's only for
+    pollen_fallback_memo seconds in case today's shows up
+    """
+    candidates = pollen_url_candidates()
+    urls = [url for url, _ in candidates]
+
+    if not force:
+        entry = read_entry("pollen_url")
+        if entry is not None and entry["expires_at"] > time.time():
+            if entry["data"]["url"] in urls:
+                return entry["data"]["url"], entry["data"].get("yesterday", False)
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=len(urls)) as executor:
+        found = list(executor.map(carry_timing(probe_url), urls))
+
+    for (url, use_yesterday), exists in zip(candidates, found):
+        if exists:
+            if use_yesterday:
+                expires_at = min(time.time() + pollen_fallback_memo, end_of_today())
+            else:
+                expires_at = end_of_today()
+            write_entry("pollen_url", {"url": url, "yesterday": use_yesterday}, expires_at)
+            return url, use_yesterday
+
+    raise ValueError("no pollen page found, tried: " + ", ".join(urls))
+
+
+def pollen_expiry(pollen_page):
+    """
+    Cache expiry of a fetched pollen page. The day's page is
+    current until the next business day's is due, yesterday's
+    only for pollen_fallback_memo so today's is fetched once
+    it is posted
+    """
+    if pollen_page["yesterday"]:
+        return min(time.time() + pollen_fallback_memo, until_next_business_day())
+    return until_next_business_day()
+
+pollen_ttl = pollen_expiry
+
+
 def get_pollen_data():
+    """
+    Return the pollen page, {"levels", "date", "yesterday"},
+    from the on-disk cache while it is current
+    """
+    return cached_fetch("pollen_page_houston", partial(call_with_breaker, pollen_source_key, fetch_pollen_data), 
+                        pollen_ttl, pollen_stale_ttl)
+
+
+def fetch_pollen_data():
     """
     Query the Houston Health Department for pollen/allergen
     data. Only available Monday-Friday, so return the recent Friday
-    data if it is currently the weekend.
-
-    Add some fixes because COH keeps fucking up the url
+    data if it is currently the weekend. "yesterday" is set when
+    today's page isn't up yet and yesterday's was used. The page
+    date makes a new day's page a new snapshot even when the
+    levels are the same as the day before
     """
-    url_base = "https://www.houstonhealth.org/services/pollen-mold/"
-    payload_base = "houston-pollen-mold-count-"
-    payload_addition = make_payload_addition()
-    payload = payload_base+payload_addition
-    url = url_base + payload
-    timeout = 20
-    page = requests.get(url, timeout=timeout)
+    url, use_yesterday = resolve_pollen_url()
+    page = http_get(url, timeout=pollen_timeout)
 
     if page.status_code == 404:
-        payload_addition = make_payload_addition(use_yesterday=True)
-        payload = payload_base+payload_addition
-        url = url_base + payload
-        page = requests.get(url, timeout=timeout)
-
-        if page.status_code == 404:
-            ## because they fat finger the second hyphen
-            payload_addition = make_payload_addition()
-            idx = payload_addition.rfind("-")
-            payload_addition = payload_addition[:idx] + payload_addition[idx+1:]
-            payload = payload_base+payload_addition
-            url = url_base + payload
-            page = requests.get(url, timeout=timeout)
-
-            if page.status_code == 404:
-                ## because they fat finger the second hyphen
-                payload_addition = make_payload_addition(use_yesterday=True)
-                idx = payload_addition.rfind("-")
-                payload_addition = payload_addition[:idx] + payload_addition[idx+1:]
-                payload = payload_base+payload_addition
-                url = url_base + payload
-                page = requests.get(url, timeout=timeout)
+        ## remembered page went away, look again
+        page.close()
+        url, use_yesterday = resolve_pollen_url(force=True)
+        page = http_get(url, timeout=pollen_timeout)
     
-    soup = BeautifulSoup(page.content, "html.parser")
-    tmp = soup.find_all("p", class_="text-align-center")
+    records = parse_pollen_page(page.text)
     page.close()
-    
+
     pollen_data = {}
-    for i in tmp:
-        tmp_data = str(i)[37:].replace("</strong><br/><strong>", " ").split()
-        pollen_type = ' '.join([tmp_data[0], tmp_data[1]])
-        pollen_level = tmp_data[2]
-        if tmp_data[3].lower() == "heavy": #needed for houston
-            pollen_level = "extremely heavy"
-        pollen_type = pollen_type.replace("<br/>", "")
-        pollen_level = pollen_level.replace("<br/>", "")
-        pollen_data[pollen_type] = pollen_level
+    for record in records:
+        pollen_data[record.type] = record.level
+    if not pollen_data:
+        raise ValueError("no pollen levels on " + url)
 
-    return pollen_data
+    return {"levels": pollen_data, "date": str(pollen_page_date(use_yesterday)),
+            "yesterday": use_yesterday}
+
+
+## Allergens reported on the pollen page, parsing stops
+## once all of them have been read
+pollen_types = ["TREE POLLEN", "WEED POLLEN", "GRASS POLLEN", "MOLD SPORES"]
+pollen_block_marker = 'class="text-align-center"'
+pollen_parse_chunk = 4096
+
+PollenRecord = namedtuple("PollenRecord", ["type", "level", "count"])
+
+
+class PollenBlockParser(HTMLParser):
+    """
+    Collect the text pieces of each <p class="text-align-center">
+    paragraph, e.g. ["TREE POLLEN", "LOW", "12 per cubic meter"]
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.in_block = False
+        self.pieces = []
+        self.blocks = []
+
+    def handle_starttag(self, tag, attrs):
+        if tag == "p" and "text-align-center" in (dict(attrs).get("class") or "").split():
+            self.in_block = True
+            self.pieces = [""]
+        elif tag == "br" and self.in_block:
+            self.pieces.append("")
+
+    def handle_endtag(self, tag):
+        if tag == "p" and self.in_block:
+            self.in_block = False
+            self.blocks.append([p.strip() for p in self.pieces if p.strip()])
+
+    def handle_data(self, data):
+        if self.in_block:
+            self.pieces[-1] = self.pieces[-1] + data
+
+    def done(self):
+        found = set(b[0].upper() for b in self.blocks if b)
+        return all(t in found for t in pollen_types)
+
+
+def parse_pollen_count(text):
+    """
+    First number in text, e.g. "6,412 per cubic meter" -> 6412
+    """
+    match = re.search(r"\d[\d,]*", text)
+    if match is None:
+        return None
+    return int(match.group().replace(",", ""))
+
+
+def parse_pollen_page(html):
+    """
+    Extract (type, level, count) records from the pollen page.
+    Skips ahead to the first pollen paragraph and stops parsing
+    as soon as every allergen has been read
+    """
+    start = html.find(pollen_block_marker)
+    if start == -1:
+        return []
+    start = html.rfind("<", 0, start)
+
+    parser = PollenBlockParser()
+    for i in range(start, len(html), pollen_parse_chunk):
+        parser.feed(html[i:i+pollen_parse_chunk])
+        if parser.done():
+            break
+
+    records = []
+    for block in parser.blocks:
+        if len(block) < 2:
+            continue
+        count = None
+        for piece in block[2:]:
+            count = parse_pollen_count(piece)
+            if count is not None:
+                break
+        records.append(PollenRecord(block[0].upper(), block[1].lower(), count))
+
+    return records
 
 
 
@@ -460,7 +595,7 @@ def get_weather(weather_api_key, latitude, longitude):
     lat_str = "lat="+latitude
     long_str = "&lon="+longitude
     api_str = "&appid="+weather_api_key
-    with requests.get(base+lat_str+long_str+api_str, timeout=30) as response:
+    with http_get(base+lat_str+long_str+api_str, timeout=weather_timeout) as response:
         try:
             return response
         finally:
@@ -487,7 +622,62 @@ def convert_utc(utc, offset=-18000):
     return stamp
 
 
-def current_conditions(response):
+## The onecall fields the dashboard draws from. Temperatures
+## are in Kelvin and times UTC timestamps, as OpenWeatherMap
+## sends them
+CurrentWeather = namedtuple("CurrentWeather", ["dt", "sunrise", "sunset", "feels_like",
+                                               "humidity", "uvi", "condition_id"])
+HourlyWeather = namedtuple("HourlyWeather", ["dt", "feels_like", "condition_id"])
+DailyWeather = namedtuple("DailyWeather", ["dt", "sunrise", "sunset", "temp_min",
+                                           "temp_max", "condition_id"])
+
+
+@dataclass
+class WeatherSnapshot:
+    """
+    Decoded OpenWeatherMap onecall payload, shared by
+    the current, hourly and daily extractors
+    """
+    current: CurrentWeather
+    hourly: list
+    daily: list
+
+
+def decode_weather(payload):
+    """
+    Build a WeatherSnapshot from a decoded onecall
+    payload, None if the payload is missing or malformed
+    """
+    try:
+        current = payload["current"]
+        return WeatherSnapshot(
+            current=CurrentWeather(dt=current["dt"], sunrise=current["sunrise"],
+                                   sunset=current["sunset"], feels_like=current["feels_like"],
+                                   humidity=current["humidity"], uvi=current["uvi"],
+                                   condition_id=current["weather"][0]["id"]),
+            hourly=[HourlyWeather(dt=hour["dt"], feels_like=hour["feels_like"],
+                                  condition_id=hour["weather"][0]["id"])
+                    for hour in payload["hourly"]],
+            daily=[DailyWeather(dt=day["dt"], sunrise=day["sunrise"], sunset=day["sunset"],
+                                temp_min=day["temp"]["min"], temp_max=day["temp"]["max"],
+                                condition_id=day["weather"][0]["id"])
+                   for day in payload["daily"]])
+    except (KeyError, IndexError, TypeError):
+        return None
+
+
+def parse_weather(response):
+    """
+    Decode the onecall response a single time
+    """
+    try:
+        payload = json.loads(response.text)
+    except (AttributeError, ValueError):
+        return None
+    return decode_weather(payload)
+
+
+def current_conditions(snapshot):
     """
     Return the current 'feels like' temperature
     in degrees F, current humidity, current
@@ -499,20 +689,19 @@ def current_conditions(response):
     conditions["uvi"] = None
     conditions["id"] = None
     conditions["daytime"] = False
-    try:
-        resp = json.loads(response.text)
-    except:
+    if snapshot is None:
         return conditions
-    temp_K = resp['current']['feels_like']
+    current = snapshot.current
+    temp_K = current.feels_like
     temp_f = kelvin_to_farenheit(temp_K)
 
-    humidity = resp['current']['humidity']
+    humidity = current.humidity
 
-    uvi = resp['current']['uvi']
+    uvi = current.uvi
 
-    id = resp["current"]["weather"][0]["id"]
+    id = current.condition_id
 
-    if resp["current"]["sunrise"] < resp["current"]["dt"] < resp["current"]["sunset"]:
+    if current.sunrise < current.dt < current.sunset:
         conditions["daytime"] = True
 
     conditions["temp_f"] = temp_f
@@ -523,41 +712,41 @@ def current_conditions(response):
     return conditions
 
 
-def hourly_forecast(response, hours=8):
+def hourly_forecast(snapshot, hours=8):
     """
     Return the hourly forecasted 'feels like' temperature
     and weather id
     """
 
     hourly_forecast  = []
-    try:
-        resp = json.loads(response.text)
-    except:
+    if snapshot is None:
         for i in range(hours):
             tmp_dict = {}
+            tmp_dict[str(i)] = {}
             tmp_dict[str(i)]["temp_f"] = None
             tmp_dict[str(i)]["id"] = None
+            tmp_dict[str(i)]["daytime"] = False
             hourly_forecast.append(tmp_dict)
         return hourly_forecast
     
-    sunrise_today = resp["current"]["sunrise"]
-    sunset_today = resp["current"]["sunset"]
-    sunrise_tomorrow = resp["daily"][0]["sunrise"]
-    sunset_tomorrow = resp["daily"][0]["sunset"]
+    sunrise_today = snapshot.current.sunrise
+    sunset_today = snapshot.current.sunset
+    sunrise_tomorrow = snapshot.daily[0].sunrise
+    sunset_tomorrow = snapshot.daily[0].sunset
 
-    forecast = resp["hourly"][:hours]
+    forecast = snapshot.hourly[:hours]
     for f in forecast:
-        time = f["dt"]
+        time = f.dt
         hour = convert_utc(time).hour
         if hour > 12:
             hour = hour-12
         if hour == 0:
             hour = 12
 
-        temp_K = f["feels_like"]
+        temp_K = f.feels_like
         temp_f = kelvin_to_farenheit(temp_K)
 
-        id = f["weather"][0]["id"]
+        id = f.condition_id
 
         tmp_dict = {}
         tmp_dict[str(hour)] = {}
@@ -574,38 +763,37 @@ def hourly_forecast(response, hours=8):
     return hourly_forecast
 
 
-def daily_forecast(response, days=5):
+def daily_forecast(snapshot, days=5):
     """
     Return the daily forecasted min/max temperatures
     and weather id
     """
 
     daily_forecast  = []
-    try:
-        resp = json.loads(response.text)
-    except:
+    if snapshot is None:
         for i in range(days):
             tmp_dict = {}
+            tmp_dict[str(i)] = {}
             tmp_dict[str(i)]["max_temp"] = None
             tmp_dict[str(i)]["min_temp"] = None
             tmp_dict[str(i)]["id"] = None
             daily_forecast.append(tmp_dict)
         return daily_forecast
 
-    forecast = resp["daily"][:days]
+    forecast = snapshot.daily[:days]
     for f in forecast:
-        day = f["dt"]
+        day = f.dt
         day  = convert_utc(day).weekday()
         day_list = ["MON", "TUE","WED", "THU", "FRI", "SAT", "SUN"]
         day = day_list[day]
 
-        max_temp = f["temp"]["max"]
+        max_temp = f.temp_max
         max_temp = kelvin_to_farenheit(max_temp)
 
-        min_temp = f["temp"]["min"]
+        min_temp = f.temp_min
         min_temp = kelvin_to_farenheit(min_temp)
 
-        id = f["weather"][0]["id"]
+        id = f.condition_id
 
         tmp_dict = {}
         tmp_dict[str(day)] = {}
@@ -617,20 +805,241 @@ def daily_forecast(response, days=5):
     return daily_forecast
 
 
-def make_weather_data(**kwargs):
+def fetch_weather_payload(**kwargs):
     """
-    Create dictionary of current and forecasted weather conditions
+    Fetch and decode the onecall payload
+    """
+    response = get_weather(**kwargs)
+    if response.status_code != 200:
+        raise ValueError("OpenWeatherMap returned HTTP {}".format(response.status_code))
+    return json.loads(response.text)
+
+
+def get_weather_payload(weather_api_key, latitude, longitude):
+    """
+    Decoded onecall payload, from the cache while it is fresh
+    """
+    key = "owm_{}_{}".format(latitude, longitude)
+    fetch = partial(call_with_breaker, weather_source_key(latitude, longitude), fetch_weather_payload, 
+                    weather_api_key=weather_api_key, latitude=latitude, longitude=longitude)
+    return cached_fetch(key, fetch, weather_ttl, weather_stale_ttl)
+
+
+def build_weather_data(payload):
+    """
+    Create dictionary of current and forecasted weather
+    conditions from a decoded onecall payload
     """
     weather_data = {}
     
-    response = get_weather(**kwargs)
+    snapshot = decode_weather(payload)
 
-    current_weather = current_conditions(response)
-    hourly_weather = hourly_forecast(response, hours=8)
-    daily_weather = daily_forecast(response, days=5)
+    current_weather = current_conditions(snapshot)
+    hourly_weather = hourly_forecast(snapshot, hours=8)
+    daily_weather = daily_forecast(snapshot, days=5)
 
     weather_data["current"] = current_weather
     weather_data["hourly"] = hourly_weather
     weather_data["daily"] = daily_weather
 
     return weather_data
+
+
+def make_weather_data(**kwargs):
+    """
+    Create dictionary of current and forecasted weather conditions
+    """
+    return build_weather_data(get_weather_payload(**kwargs))
+
+
+##~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+## LOCATION PROFILES
+## One process can draw several locations. Each source a
+## profile draws from has a key naming the source and its
+## parameters, profiles with the same key share one fetch
+
+@dataclass
+class LocationProfile:
+    """
+    A location drawn by the dashboard and where its frames
+    go, see sinks.make_sink for the sink specs
+    """
+    name: str
+    latitude: str
+    longitude: str
+    zipcode: str
+    ## the pollen count is Houston's, off for other cities
+    pollen: bool = True
+    sink: str = "epd"
+
+
+## Source keys also name the sources' circuit breakers, so a
+## failing location doesn't cut off the others
+pollen_source_key = "pollen@houston"
+
+
+def weather_source_key(latitude, longitude):
+    return "weather@{},{}".format(latitude, longitude)
+
+
+def aq_source_key(zipcode):
+    return "air_quality@" + zipcode
+
+
+def source_keys(profile):
+    """
+    Source key of each data source a profile draws
+    """
+    keys = {
+        "weather": weather_source_key(profile.latitude, profile.longitude),
+        "air_quality": aq_source_key(profile.zipcode),
+    }
+    if profile.pollen:
+        keys["pollen"] = pollen_source_key
+    return keys
+
+
+def source_kind(key):
+    """
+    The data source a source key is for, e.g. "weather"
+    """
+    return key.split("@", 1)[0]
+
+
+##~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+## CONCURRENT FETCH
+## Run every data source at the same time
+
+fetch_deadline = 40
+
+
+def dashboard_sources(weather_api_key, airnow_api_key, latitude, longitude, zipcode="77008"):
+    """
+    Fetch function for each data source, returning its
+    decoded payload
+    """
+    return {
+        "weather": partial(get_weather_payload, weather_api_key=weather_api_key,
+                           latitude=latitude, longitude=longitude),
+        "pollen": get_pollen_data,
+        "air_quality": partial(get_aq_records, airnow_api_key=airnow_api_key, zipcode=zipcode),
+    }
+
+
+def profile_sources(profiles, weather_api_key, airnow_api_key):
+    """
+    Fetch function of every distinct source the profiles
+    draw, by source key
+    """
+    sources = {}
+    for profile in profiles:
+        fetchers = dashboard_sources(weather_api_key, airnow_api_key, profile.latitude,
+                                     profile.longitude, profile.zipcode)
+        for kind, key in source_keys(profile).items():
+            sources.setdefault(key, fetchers[kind])
+    return sources
+
+
+def fetch_sources(sources, deadline=fetch_deadline):
+    """
+    Call every fetch function in sources, {name: fetch},
+    concurrently. Every source shares one overall deadline
+    (seconds), sources that fail or are still running at the
+    deadline come back as None so each quadrant can render
+    from what finished
+    """
+    results = dict.fromkeys(sources)
+
+    def fetch_source(name, fetch):
+        with timed("fetch " + name):
+            return fetch()
+
+    executor = concurrent.futures.ThreadPoolExecutor(max_workers=len(sources))
+    futures = {executor.submit(carry_timing(fetch_source), name, fetch): name 
+               for name, fetch in sources.items()}
+    done, not_done = concurrent.futures.wait(futures, timeout=deadline)
+
+    for future in done:
+        name = futures[future]
+        try:
+            results[name] = future.result()
+        except Exception:
+            logging.exception("FAIL fetching %s data", name)
+
+    for future in not_done:
+        logging.warning("%s data missed the %s s fetch deadline", 
+                        futures[future], deadline)
+
+    ## don't wait on stragglers, they finish on their own timeouts
+    executor.shutdown(wait=False, cancel_futures=True)
+
+    states = breaker_states()
+    if any(state != "closed" for state in states.values()):
+        logging.warning("source breakers: %s", states)
+
+    return results
+
+
+def fetch_dashboard_data(weather_api_key, airnow_api_key, latitude, longitude,
+                         zipcode="77008", deadline=fetch_deadline):
+    """
+    Fetch the decoded weather, pollen and air quality payloads
+    of one location concurrently, see fetch_sources.
+    parse_dashboard_data turns the payloads into the data the
+    display draws
+    """
+    return fetch_sources(dashboard_sources(weather_api_key, airnow_api_key,
+                                           latitude, longitude, zipcode), deadline)
+
+
+## How each fetched payload becomes display data,
+## pollen is already parsed before it is cached
+source_parsers = {
+    "weather": build_weather_data,
+    "pollen": lambda pollen_page: pollen_page["levels"],
+    "air_quality": build_air_quality,
+}
+
+
+def parse_source(name, payload):
+    """
+    Display data of one source's payload, None when it
+    is missing or fails to parse
+    """
+    if payload is None:
+        return None
+    try:
+        with timed("parse " + name):
+            return source_parsers[name](payload)
+    except Exception:
+        logging.exception("FAIL parsing %s data", name)
+        return None
+
+
+def parse_dashboard_data(payloads):
+    """
+    Build the display data from fetched payloads, a source
+    that is missing or fails to parse is None
+    """
+    return {name: parse_source(name, payloads.get(name)) for name in source_parsers}
+
+
+def parse_profile_data(profiles, payloads):
+    """
+    Display data of every profile from payloads by source
+    key, a source shared by several profiles is parsed once.
+    Sources a profile switched off are listed under "off"
+    """
+    parsed = {}
+    profile_data = {}
+    for profile in profiles:
+        keys = source_keys(profile)
+        dashboard_data = {}
+        for name in source_parsers:
+            key = keys.get(name)
+            if key not in parsed:
+                parsed[key] = parse_source(name, payloads.get(key))
+            dashboard_data[name] = parsed[key]
+        dashboard_data["off"] = [name for name in source_parsers if name not in keys]
+        profile_data[profile.name] = dashboard_data
+    return profile_data
@@ -3,9 +3,23 @@
 from PIL import Image,ImageDraw,ImageFont
 from dashboard_data import *
 import time
-import schedule
 from datetime import datetime
-import requests
+from http_client import internet_available, close_sessions
+from icons import get_icon, preload_icons
+from palette import new_panel_image
+from memwatch import enable_memory_instrumentation, start_refresh, memory_stage, end_refresh
+from metrics import start_timing, timed, note_outcome, note_sources, finish_timing
+from snapshot_store import latest_snapshots, collect_once, start_collector, stop_collector, collector_running, source_metrics
+from functools import lru_cache
+from startup import wait_until_ready, mark, report_startup
+from text_cache import draw_text
+from scheduler import Scheduler, Job, hourly_at, daily_at
+from sinks import make_sink, close_sinks
+from frame_server import start_frame_server, stop_frame_server
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+import multiprocessing
+from frame_state import data_fingerprint, frame_fingerprint, load_display_state, save_display_state, clear_display_state
 import logging
 from logging.handlers import RotatingFileHandler
 import os
@@ -15,6 +29,8 @@ import os
 ## SET DEBUG MODE
 ## If set to True, will write image to specified directory
 ## If set to False, will send image to epaper
+## With several location profiles, the frames after the
+## first are saved next to it with the profile name added
  
 ## Note epaper libraries are only available on linux, so 
 ## calls to epaper/epd will only happen in debug=False
@@ -25,38 +41,27 @@ debug_save_location = "./debug_img.jpg"
 ##~~~~~~~~~~~~~~~~~
 ## PARAMETERS
 
-if debug:
-    epd_height = 480
-    epd_width = 800
-    black = "black"
-    white = "white"
-    red = "red"
-    orange = "orange"
-    yellow = "yellow"
-    green = "green"
-    blue = "blue"
-    
-else:
-    import epaper
-    epap_model = "epd7in3f"
-    epd = epaper.epaper(epap_model).EPD()
-    epd_height = epd.height
-    epd_width = epd.width
-    black = epd.BLACK
-    white = epd.WHITE
-    red = epd.RED
-    orange = epd.ORANGE
-    yellow = epd.YELLOW
-    green = epd.GREEN
-    blue = epd.BLUE
-
-
-## Make fonts
-nasa_font_10 = ImageFont.truetype("./nasalization-rg.otf", 10)
-nasa_font_18 = ImageFont.truetype("./nasalization-rg.otf", 18)
-nasa_font_20 = ImageFont.truetype("./nasalization-rg.otf", 20)
-nasa_font_28 = ImageFont.truetype("./nasalization-rg.otf", 28)
-nasa_font_32 = ImageFont.truetype("./nasalization-rg.otf", 32)
+## Canvas mode, "P" draws straight onto the panel's 7 colour
+## palette at a third of the memory of "RGB"
+render_mode = "P"
+
+## epd7in3f resolution, the EPD driver itself is only
+## created when the first frame is sent (sinks.PanelSink)
+epd_height = 480
+epd_width = 800
+
+colors = panel_colors(debug, render_mode)
+black = colors["black"]
+white = colors["white"]
+red = colors["red"]
+orange = colors["orange"]
+yellow = colors["yellow"]
+green = colors["green"]
+blue = colors["blue"]
+
+
+## Fonts are opened on first use, see get_font
+font_path = "./nasalization-rg.otf"
 
 ## Text color parameters
 main_text_col = red
@@ -71,9 +76,58 @@ upper_left_coords = (5,35,395,250)
 upper_right_coords = (405,35,795,250)
 lower_coords = (5,260,795,475)
 
-## API parameters
-heights_lat = "29.8068"
-heights_long = "-95.4181"
+## Snapshots older than this (seconds) are labelled with their
+## age. Pollen is only posted on weekdays, so Friday's counts
+## are still current on Monday morning
+stale_after = {
+    "weather": 40*60,
+    "air_quality": 3*60*60,
+    "pollen": 4*24*60*60,
+}
+stale_label_names = {"weather": "weather", "air_quality": "AQ", "pollen": "pollen"}
+
+## Where each quadrant's stale labels go, (xy, text anchor)
+stale_label_locs = {
+    "weather": [((upper_left_coords[0]+95, upper_left_coords[1]+8), "la"),
+                ((lower_coords[0]+120, lower_coords[1]+12), "la")],
+    "pollen": [((upper_right_coords[0]+12, upper_right_coords[1]+38), "la")],
+    "air_quality": [((upper_right_coords[2]-15, upper_right_coords[1]+150), "ra")],
+}
+
+## Frame buffer packing, "numpy" for the vectorized packer
+## in framebuffer.py or "getbuffer" for the Waveshare driver's
+buffer_packer = "numpy"
+
+## Panel is cleared and left alone between these times,
+## "kill -USR1" the process to refresh and end them early
+quiet_hours = ("23:00", "06:00")
+
+## seconds a scheduled refresh/clear may take before it is
+## given up on
+refresh_timeout = 5*60
+clear_timeout = 2*60
+
+## Log peak/retained memory per refresh stage and warn on
+## growth across refreshes, see memwatch.py
+memory_instrumentation = False
+
+## At boot, wait up to this many seconds for the SPI device
+## and the network before drawing the first frame
+readiness_timeout = 60
+
+## Locations drawn by this process, each to its own sink:
+## "epd" for the panel on this Pi, "file:<path>" for a PNG
+## another panel picks up or "http" to serve the frame to thin
+## clients (frame_server.py). Sources shared between profiles
+## are fetched once per cycle
+location_profiles = [
+    LocationProfile("heights", latitude="29.8068", longitude="-95.4181",
+                    zipcode="77008", sink="epd"),
+]
+
+## Frames of several profiles render in parallel on this many
+## worker processes, None for one per CPU
+render_workers = None
 
 ## log setup
 logpath = "./logfile"
@@ -85,411 +139,811 @@ logging.basicConfig(format='%(asctime)s [%(levelname)s] %(message)s',
 
 ##~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
 
-def make_display(debug=debug):
+def new_canvas():
+    """
+    Blank white frame in render_mode
+    """
+    if render_mode == "P":
+        return new_panel_image((epd_width, epd_height))
+    return Image.new("RGB", (epd_width, epd_height), white)
+
+
+def new_draw(image):
+    """
+    ImageDraw for a frame, text on palette frames is drawn
+    without antialiasing since blended palette indices are
+    meaningless
+    """
+    draw = ImageDraw.Draw(image)
+    if image.mode == "P":
+        draw.fontmode = "1"
+    return draw
+
+
+@lru_cache(maxsize=None)
+def get_font(size):
+    """
+    The dashboard font at size, opened the first time it's drawn
+    """
+    return ImageFont.truetype(font_path, size)
+
+
+def profile_sink(profile):
+    """
+    Output sink a profile's frames are sent to
+    """
+    return make_sink(profile.sink, (epd_width, epd_height), packer=buffer_packer, 
+                     name=profile.name)
+
+
+## Layout of the allergen row and air quality boxes
+allergen_xlocs = [440, 530, 620, 710]
+allergen_yloc = 95
+today_ozone_coords = (upper_right_coords[0]+100, upper_right_coords[1]+25,
+                      upper_right_coords[0]+235, upper_right_coords[1]+50)
+today_part_coords = (upper_right_coords[0]+240, upper_right_coords[1]+25,
+                     upper_right_coords[0]+375, upper_right_coords[1]+50)
+tomorrow_ozone_coords = (upper_right_coords[0]+50, upper_right_coords[1]+185,
+                         upper_right_coords[0]+185, upper_right_coords[1]+210)
+tomorrow_part_coords = (upper_right_coords[0]+210, upper_right_coords[1]+185,
+                        upper_right_coords[0]+345, upper_right_coords[1]+210)
+
+_static_layer = None
+
+
+def render_static_layer():
+    """
+    Draw everything that is the same on every refresh:
+    boxes, titles, labels, allergen icons and dividers
+    """
+    static_layer = new_canvas()
+    draw = new_draw(static_layer)
+    ## Upper left quadrant
+    draw.rounded_rectangle(upper_left_coords, outline=outline_color, 
+                           width=outline_width, radius=corner_radius)
+    ## Upper right quadrant
+    draw.rounded_rectangle(upper_right_coords, outline=outline_color, 
+                           width=outline_width, radius=corner_radius)
+    ## Lower zone
+    draw.rounded_rectangle(lower_coords, outline=outline_color, 
+                           width=outline_width, radius=corner_radius)
     
+    ## PIZZAZZ
+    icon_path = "./icons/astros.bmp"
+    static_layer.paste(get_icon(icon_path, (90,90), render_mode), (355,210))
+
+    draw.text((210, 0), 'LAUNCHPAD STATUS', font=get_font(32), fill=main_text_col)
+
+    ## Upper right, allergen icons
+    icon_path = "./icons/tree.bmp"
+    static_layer.paste(get_icon(icon_path, (40,40), render_mode), (allergen_xlocs[0],allergen_yloc))
+
+    icon_path = "./icons/weed.bmp"
+    static_layer.paste(get_icon(icon_path, (40,40), render_mode), (allergen_xlocs[1],allergen_yloc))
+
+    icon_path = "./icons/grass.bmp"
+    static_layer.paste(get_icon(icon_path, (40,40), render_mode), (allergen_xlocs[2],allergen_yloc))
+    
+    icon_path = "./icons/mold.bmp"
+    static_layer.paste(get_icon(icon_path, (40,40), render_mode), (allergen_xlocs[3],allergen_yloc))
+
+    ## Upper right, labels
+    draw.text((upper_right_coords[0]+10, upper_right_coords[1]+5), 
+                'TODAY', font=get_font(20), fill=sub_text_col2)
+    draw.text((upper_right_coords[0]+10, upper_right_coords[1]+140), 
+                'TOMORROW', font=get_font(20), fill=sub_text_col2)
+    draw.text((today_ozone_coords[0]+38, today_ozone_coords[1]-20), 
+                'ozone', font=get_font(18), fill=sub_text_col1)
+    draw.text((today_part_coords[0]+10, today_part_coords[1]-20), 
+                'particulates', font=get_font(18), fill=sub_text_col1)
+    draw.text((tomorrow_ozone_coords[0]+38, tomorrow_ozone_coords[1]-20), 
+                'ozone', font=get_font(18), fill=sub_text_col1)
+    draw.text((tomorrow_part_coords[0]+10, tomorrow_part_coords[1]-20), 
+                'particulates', font=get_font(18), fill=sub_text_col1)
+
+    ## Lower, decorative divider lines and labels
+    center_x = epd_width//2
+    box_top = lower_coords[1]
+    box_bottom = lower_coords[3]
+    draw.line((center_x-6, box_top+50, center_x-6, box_bottom-10),
+             fill=orange, width=4)
+    draw.line((center_x-2, box_top+50, center_x-2, box_bottom-10),
+             fill=yellow, width=4)
+    draw.line((center_x+2, box_top+50, center_x+2, box_bottom-10),
+             fill=red, width=4)
+
+    draw.text((lower_coords[0]+10, lower_coords[1]+5), 
+              'HOURLY', font=get_font(20), fill=sub_text_col2)
+    draw.text((lower_coords[2]-75, lower_coords[1]+5), 
+              'DAILY', font=get_font(20), fill=sub_text_col2)
+
+    return static_layer
+
+
+def get_static_layer():
+    """
+    Return the static layer, rendered once per process
+    """
+    global _static_layer
+    if _static_layer is None:
+        _static_layer = render_static_layer()
+    return _static_layer
+
+
+def draw_update_time(my_display):
+    """
+    Stamp the frame with the time of this update
+    """
+    draw = new_draw(my_display)
+    update_date = datetime.now().strftime("%b %d")
+    update_time = datetime.now().strftime("%I:%M")
+    if update_time[0]=="0":
+        update_time = update_time[1:]
+    draw.text((680, 0), 'last updated: '+ update_date, 
+              font=get_font(10), fill=sub_text_col1)
+    draw.text((755, 10), update_time, 
+              font=get_font(10), fill=sub_text_col1)
+
+
+def data_age(seconds):
+    """
+    Short age of a snapshot, e.g. "45m", "3h" or "2d"
+    """
+    minutes = int(seconds // 60)
+    if minutes < 120:
+        return "{}m".format(minutes)
+    if minutes < 48*60:
+        return "{}h".format(minutes // 60)
+    return "{}d".format(minutes // (24*60))
+
+
+def stale_labels(snapshots, now=None):
+    """
+    Age label of every source whose snapshot is older than
+    its stale_after, None for up to date sources
+    """
+    now = time.time() if now is None else now
+    labels = {}
+    for source, limit in stale_after.items():
+        snapshot = snapshots.get(source)
+        labels[source] = None
+        if snapshot is not None and now - snapshot["fetched_at"] > limit:
+            labels[source] = "{} {} old".format(stale_label_names[source],
+                                                data_age(now - snapshot["fetched_at"]))
+    return labels
+
+
+def draw_stale_labels(my_display, labels):
+    """
+    Mark the quadrants drawn from stale data with its age
+    """
+    for source, label in labels.items():
+        if label is None:
+            continue
+        for xy, anchor in stale_label_locs[source]:
+            draw_text(my_display, xy, label, font=get_font(10), fill=main_text_col, anchor=anchor)
+
+
+def offset(coords, origin):
+    """
+    Shift canvas coordinates, (x, y) or (x0, y0, x1, y1),
+    into a tile whose top left corner is at origin
+    """
+    return tuple(c - origin[i % 2] for i, c in enumerate(coords))
+
+
+def render_current_tile(tile, origin, current, debug=debug):
+    """
+    Upper left quadrant, current conditions
+    """
     try:
-        ## Check internet connection
-        url = "http://www.google.com"
-        timeout = 5
-        session = requests.Session()
-        with session.get(url, timeout=timeout) as response:
-            pass
-        session.close()
+        if current is None:
+            raise ValueError("no weather data")
+        temp_f = current["temp_f"]
+        humidity = current["humidity"]
+        uvi = current["uvi"]
+        weather_id = current["id"]
+        is_daytime = current["daytime"]
+        curr_uvi_color = uvi_color(uvi, debug=debug, mode=render_mode)
         
-        try:
-            ## Draw canvas
-            if not debug:
-                epd.init()
-                epd.Clear()
-            my_display = Image.new("RGB", (epd_width, epd_height), white)
-            draw = ImageDraw.Draw(my_display)
-            ## Upper left quadrant
-            draw.rounded_rectangle(upper_left_coords, outline=outline_color, 
-                                   width=outline_width, radius=corner_radius)
-            ## Upper right quadrant
-            draw.rounded_rectangle(upper_right_coords, outline=outline_color, 
-                                   width=outline_width, radius=corner_radius)
-            ## Lower zone
-            draw.rounded_rectangle(lower_coords, outline=outline_color, 
-                                   width=outline_width, radius=corner_radius)
-            
-            ## PIZZAZZ
-            icon_path = "./icons/astros.bmp"
-            with Image.open(icon_path) as astros_logo:
-                newsize = (90,90)
-                astros_logo = astros_logo.resize(newsize, Image.NEAREST)
-                my_display.paste(astros_logo, (355,210))
-
-            draw.text((210, 0), 'LAUNCHPAD STATUS', font=nasa_font_32, fill=main_text_col)
+        ## Icons
+        if temp_f > 85:
+            icon_path = "./icons/thermo_hi.bmp"
+        elif temp_f < 50:
+            icon_path = "./icons/thermo_low.bmp"
+        else:
+            icon_path = "./icons/thermo_mid.bmp"
+        tile.paste(get_icon(icon_path, (50,110), render_mode), offset((25,40), origin))
+
+        humid_uv_xloc = upper_left_coords[0]+250
+        humid_uv_ylocs = [upper_left_coords[1]+5, upper_left_coords[1]+100]
+        humid_uv_icon_yoffset = 35
+        icon_path = "./icons/humidity.bmp"
+        tile.paste(get_icon(icon_path, (40,40), render_mode), 
+                   offset((humid_uv_xloc, humid_uv_ylocs[0]+humid_uv_icon_yoffset), origin))
         
-            ## update time
-            update_date = datetime.now().strftime("%b %d")
-            update_time = datetime.now().strftime("%I:%M")
-            if update_time[0]=="0":
-                update_time = update_time[1:]
-            draw.text((680, 0), 'last updated: '+ update_date, 
-                      font=nasa_font_10, fill=sub_text_col1)
-            draw.text((755, 10), update_time, 
-                      font=nasa_font_10, fill=sub_text_col1)
-            
-            ##~~~~~~~~~~~~~
-            ## POPULATE QUADRANTS
-            
-            ## Upper left
-            try:
-                weather_data = make_weather_data(weather_api_key=weather_api_key, 
-                                latitude=heights_lat, 
-                                longitude=heights_long)
-                temp_f = weather_data["current"]["temp_f"]
-                humidity = weather_data["current"]["humidity"]
-                uvi = weather_data["current"]["uvi"]
-                weather_id = weather_data["current"]["id"]
-                is_daytime = weather_data["current"]["daytime"]
-                curr_uvi_color = uvi_color(uvi, debug=debug)
-                
-                ## Icons
-                if temp_f > 85:
-                    icon_path = "./icons/thermo_hi.bmp"
-                elif temp_f < 50:
-                    icon_path = "./icons/thermo_low.bmp"
-                else:
-                    icon_path = "./icons/thermo_mid.bmp"
-                with Image.open(icon_path) as thermometer:
-                    newsize = (50,110)
-                    thermometer = thermometer.resize(newsize, Image.NEAREST)
-                    my_display.paste(thermometer, (25,40))
-
-                humid_uv_xloc = upper_left_coords[0]+250
-                humid_uv_ylocs = [upper_left_coords[1]+5, upper_left_coords[1]+100]
-                humid_uv_icon_yoffset = 35
-                icon_path = "./icons/humidity.bmp"
-                with Image.open(icon_path) as humid_icon:
-                    newsize = (40,40)
-                    humid_icon = humid_icon.resize(newsize, Image.NEAREST)
-                    my_display.paste(humid_icon, (humid_uv_xloc, humid_uv_ylocs[0]+humid_uv_icon_yoffset))
-                
-                if round(uvi)<=2:
-                    icon_path = "./icons/uv_low.bmp"
-                elif round(uvi)<=5:
-                    icon_path = "./icons/uv_medium.bmp"
-                elif round(uvi)<=7:
-                    icon_path = "./icons/uv_moderate.bmp"
-                elif round(uvi)>=8:
-                    icon_path = "./icons/uv_high.bmp"
-                else:
-                    icon_path = "./icons/uv.bmp"
-                with Image.open(icon_path) as uv_icon:
-                    newsize = (40,40)
-                    uv_icon = uv_icon.resize(newsize, Image.NEAREST)
-                    my_display.paste(uv_icon, (humid_uv_xloc, humid_uv_ylocs[1]+humid_uv_icon_yoffset))
-
-                ## Current temperature
-                display_curr_temp = str(round(temp_f))
-                draw.text((upper_left_coords[0]+20, upper_left_coords[1]+115), 'Feels\nLike', 
-                          font=nasa_font_20, fill=sub_text_col1)
-                draw.text((20, 200), display_curr_temp+' \N{DEGREE SIGN}F', 
-                          font=nasa_font_32,fill=sub_text_col1)
-                
-                ## Current conditions
-                condition_xloc = upper_left_coords[0]+120
-                condition_yloc = upper_left_coords[1]+40
-                current_condition_icon = get_condition_icon(weather_id, is_daytime)
-                with Image.open(current_condition_icon) as condition_icon:
-                    newsize = (100,100)
-                    condition_icon = condition_icon.resize(newsize, Image.NEAREST)
-                    my_display.paste(condition_icon, (condition_xloc, condition_yloc))
-
-
-                ## Current humidity
-                humid_uv_val_xoffset = 75
-                humid_uv_val_yoffset = 40
-
-                display_curr_humidity = str(round(humidity))
-                draw.text((humid_uv_xloc, humid_uv_ylocs[0]), 
-                          'HUMIDITY', font=nasa_font_20, fill=sub_text_col1)
-                draw.text((humid_uv_xloc+humid_uv_val_xoffset, 
-                           humid_uv_ylocs[0]+humid_uv_val_yoffset), 
-                          display_curr_humidity+'\N{DEGREE SIGN}', font=nasa_font_28, fill=sub_text_col1)
-                
-                ## UV index
-                display_curr_uvi = str(round(uvi))
-                draw.text((humid_uv_xloc, humid_uv_ylocs[1]), 
-                          'UV INDEX', font=nasa_font_20, fill=sub_text_col1)
-                draw.text((humid_uv_xloc+humid_uv_val_xoffset, 
-                           humid_uv_ylocs[1]+humid_uv_val_yoffset), 
-                          display_curr_uvi, font=nasa_font_28, fill=curr_uvi_color,
-                         stroke_width=1, stroke_fill=sub_text_col1)
-
-            except Exception as exception:
-                err_xloc = upper_left_coords[0]+50
-                err_yloc = upper_left_coords[1]+50
-                draw.text((err_xloc, err_yloc), "ERROR!", font=nasa_font_18, fill = red)
-                print(exception)
-                logging.exception("FAIL in current conditions section")
-                
-                
-            ## Upper right
-            tree_pollen_color = white
-            weed_pollen_color = white
-            grass_pollen_color = white
-            mold_spores_color = white
-            oz_color = white
-            part_color = white
-            oz_fore_color = white
-            part_fore_color = white
-
-            allergen_xlocs = [440, 530, 620, 710]
-            allergen_yloc = 95
-
-            try:
-                pollen_data = get_pollen_data()
-                tree_pollen_color = pollen_color(pollen_data["TREE POLLEN"], debug=debug)
-                weed_pollen_color = pollen_color(pollen_data["WEED POLLEN"], debug=debug)
-                grass_pollen_color = pollen_color(pollen_data["GRASS POLLEN"], debug=debug)
-                mold_spores_color = pollen_color(pollen_data["MOLD SPORES"], debug=debug)
-                
-                air_quality = get_air_quality(airnow_api_key=airnow_api_key)
-                oz_color = aq_color(air_quality["ozone_code_current"], debug=debug)
-                part_color = aq_color(air_quality["part_code_current"], debug=debug)
-                oz_fore_color = aq_color(air_quality["ozone_code_fore"], debug=debug)
-                part_fore_color = aq_color(air_quality["part_code_fore"], debug=debug)
-
-            except Exception as exception:
-                draw.line((allergen_xlocs[0]-5, allergen_yloc+45, allergen_xlocs[3]+5, allergen_yloc+45),
-                         fill=red, width=4)
-                print(exception)
-                logging.exception("FAIL in pollen section")
-                
-            # place the icons
-            icon_path = "./icons/tree.bmp"
-            with Image.open(icon_path) as tree_7color:
-                newsize = (40,40)
-                tree_7color = tree_7color.resize(newsize, Image.NEAREST)
-                my_display.paste(tree_7color, (allergen_xlocs[0],allergen_yloc))
-
-            icon_path = "./icons/weed.bmp"
-            with Image.open(icon_path) as weed_7color:
-                newsize = (40,40)
-                weed_7color = weed_7color.resize(newsize, Image.NEAREST)
-                my_display.paste(weed_7color, (allergen_xlocs[1],allergen_yloc))
-
-            icon_path = "./icons/grass.bmp"
-            with Image.open(icon_path) as grass_7color:
-                newsize = (40,40)
-                grass_7color = grass_7color.resize(newsize, Image.NEAREST)
-                my_display.paste(grass_7color, (allergen_xlocs[2],allergen_yloc))
-            
-            icon_path = "./icons/mold.bmp"
-            with Image.open(icon_path) as mold_7color:
-                newsize = (40,40)
-                mold_7color = mold_7color.resize(newsize, Image.NEAREST)
-                my_display.paste(mold_7color, (allergen_xlocs[3],allergen_yloc))
-
-
-            # place the icon color levels
-            draw.text((allergen_xlocs[0]-5, allergen_yloc+50), 
-                        'TREE', font=nasa_font_18, fill=tree_pollen_color,
-                        stroke_width=1, stroke_fill=sub_text_col1)
-            draw.text((allergen_xlocs[1]-5, allergen_yloc+50), 
-                        'WEED', font=nasa_font_18, fill=weed_pollen_color,
-                        stroke_width=1, stroke_fill=sub_text_col1)
-            draw.text((allergen_xlocs[2]-5, allergen_yloc+50), 
-                        'GRASS', font=nasa_font_18, fill=grass_pollen_color,
-                        stroke_width=1, stroke_fill=sub_text_col1)
-            draw.text((allergen_xlocs[3]-5, allergen_yloc+50), 
-                        'MOLD', font=nasa_font_18, fill=mold_spores_color,
-                        stroke_width=1, stroke_fill=sub_text_col1)
-                
-            # place the air quality boxes
-            today_ozone_coords = (upper_right_coords[0]+100, upper_right_coords[1]+25,
-                                    upper_right_coords[0]+235, upper_right_coords[1]+50)
-            today_part_coords = (upper_right_coords[0]+240, upper_right_coords[1]+25,
-                                    upper_right_coords[0]+375, upper_right_coords[1]+50)
-            draw.rounded_rectangle(today_ozone_coords, outline=outline_color, 
-                                    width=outline_width, radius=corner_radius,
-                                    fill=oz_color)
-            draw.rounded_rectangle(today_part_coords, outline=outline_color, 
-                                    width=outline_width, radius=corner_radius,
-                                    fill=part_color)
-
-            tomorrow_ozone_coords = (upper_right_coords[0]+50, upper_right_coords[1]+185,
-                                    upper_right_coords[0]+185, upper_right_coords[1]+210)
-            tomorrow_part_coords = (upper_right_coords[0]+210, upper_right_coords[1]+185,
-                                    upper_right_coords[0]+345, upper_right_coords[1]+210)
-            draw.rounded_rectangle(tomorrow_ozone_coords, outline=outline_color, 
-                                    width=outline_width, radius=corner_radius,
-                                    fill=oz_fore_color)
-            draw.rounded_rectangle(tomorrow_part_coords, outline=outline_color, 
-                                    width=outline_width, radius=corner_radius,
-                                    fill=part_fore_color)
-            
-            # add the text
-            draw.text((upper_right_coords[0]+10, upper_right_coords[1]+5), 
-                        'TODAY', font=nasa_font_20, fill=sub_text_col2)
-            draw.text((upper_right_coords[0]+10, upper_right_coords[1]+140), 
-                        'TOMORROW', font=nasa_font_20, fill=sub_text_col2)
-            draw.text((today_ozone_coords[0]+38, today_ozone_coords[1]-20), 
-                        'ozone', font=nasa_font_18, fill=sub_text_col1)
-            draw.text((today_part_coords[0]+10, today_part_coords[1]-20), 
-                        'particulates', font=nasa_font_18, fill=sub_text_col1)
-            draw.text((tomorrow_ozone_coords[0]+38, tomorrow_ozone_coords[1]-20), 
-                        'ozone', font=nasa_font_18, fill=sub_text_col1)
-            draw.text((tomorrow_part_coords[0]+10, tomorrow_part_coords[1]-20), 
-                        'particulates', font=nasa_font_18, fill=sub_text_col1)
+        if round(uvi)<=2:
+            icon_path = "./icons/uv_low.bmp"
+        elif round(uvi)<=5:
+            icon_path = "./icons/uv_medium.bmp"
+        elif round(uvi)<=7:
+            icon_path = "./icons/uv_moderate.bmp"
+        elif round(uvi)>=8:
+            icon_path = "./icons/uv_high.bmp"
+        else:
+            icon_path = "./icons/uv.bmp"
+        tile.paste(get_icon(icon_path, (40,40), render_mode), 
+                   offset((humid_uv_xloc, humid_uv_ylocs[1]+humid_uv_icon_yoffset), origin))
+
+        ## Current temperature
+        display_curr_temp = str(round(temp_f))
+        draw_text(tile, offset((upper_left_coords[0]+20, upper_left_coords[1]+115), origin), 'Feels\nLike', 
+                  font=get_font(20), fill=sub_text_col1)
+        draw_text(tile, offset((20, 200), origin), display_curr_temp+' \N{DEGREE SIGN}F', 
+                  font=get_font(32),fill=sub_text_col1)
+        
+        ## Current conditions
+        condition_xloc = upper_left_coords[0]+120
+        condition_yloc = upper_left_coords[1]+40
+        current_condition_icon = get_condition_icon(weather_id, is_daytime)
+        tile.paste(get_icon(current_condition_icon, (100,100), render_mode), 
+                   offset((condition_xloc, condition_yloc), origin))
+
+
+        ## Current humidity
+        humid_uv_val_xoffset = 75
+        humid_uv_val_yoffset = 40
+
+        display_curr_humidity = str(round(humidity))
+        draw_text(tile, offset((humid_uv_xloc, humid_uv_ylocs[0]), origin), 
+                  'HUMIDITY', font=get_font(20), fill=sub_text_col1)
+        draw_text(tile, offset((humid_uv_xloc+humid_uv_val_xoffset, 
+                          humid_uv_ylocs[0]+humid_uv_val_yoffset), origin), 
+                  display_curr_humidity+'\N{DEGREE SIGN}', font=get_font(28), fill=sub_text_col1)
+        
+        ## UV index
+        display_curr_uvi = str(round(uvi))
+        draw_text(tile, offset((humid_uv_xloc, humid_uv_ylocs[1]), origin), 
+                  'UV INDEX', font=get_font(20), fill=sub_text_col1)
+        draw_text(tile, offset((humid_uv_xloc+humid_uv_val_xoffset, 
+                          humid_uv_ylocs[1]+humid_uv_val_yoffset), origin), 
+                  display_curr_uvi, font=get_font(28), fill=curr_uvi_color,
+                 stroke_width=1, stroke_fill=sub_text_col1)
+
+    except Exception as exception:
+        err_xloc = upper_left_coords[0]+50
+        err_yloc = upper_left_coords[1]+50
+        draw_text(tile, offset((err_xloc, err_yloc), origin), "ERROR!", font=get_font(18), fill = red)
+        print(exception)
+        logging.exception("FAIL in current conditions section")
+
+
+def render_allergen_tile(tile, origin, pollen_data, air_quality, pollen_on=True, debug=debug):
+    """
+    Upper right quadrant, pollen and air quality. With pollen
+    switched off for the location the allergen row stays blank
+    """
+    draw = new_draw(tile)
+    tree_pollen_color = white
+    weed_pollen_color = white
+    grass_pollen_color = white
+    mold_spores_color = white
+    oz_color = white
+    part_color = white
+    oz_fore_color = white
+    part_fore_color = white
+
+    try:
+        if pollen_on:
+            if pollen_data is None:
+                raise ValueError("no pollen data")
+            tree_pollen_color = pollen_color(pollen_data["TREE POLLEN"], debug=debug, mode=render_mode)
+            weed_pollen_color = pollen_color(pollen_data["WEED POLLEN"], debug=debug, mode=render_mode)
+            grass_pollen_color = pollen_color(pollen_data["GRASS POLLEN"], debug=debug, mode=render_mode)
+            mold_spores_color = pollen_color(pollen_data["MOLD SPORES"], debug=debug, mode=render_mode)
+
+    except Exception as exception:
+        draw.line(offset((allergen_xlocs[0]-5, allergen_yloc+45, allergen_xlocs[3]+5, allergen_yloc+45), origin),
+                 fill=red, width=4)
+        print(exception)
+        logging.exception("FAIL in pollen section")
+
+    try:
+        if air_quality is None:
+            raise ValueError("no air quality data")
+        oz_color = aq_color(air_quality["ozone_code_current"], debug=debug, mode=render_mode)
+        part_color = aq_color(air_quality["part_code_current"], debug=debug, mode=render_mode)
+        oz_fore_color = aq_color(air_quality["ozone_code_fore"], debug=debug, mode=render_mode)
+        part_fore_color = aq_color(air_quality["part_code_fore"], debug=debug, mode=render_mode)
+
+    except Exception as exception:
+        print(exception)
+        logging.exception("FAIL in air quality section")
+        
+    # place the icon color levels
+    draw_text(tile, offset((allergen_xlocs[0]-5, allergen_yloc+50), origin), 
+                'TREE', font=get_font(18), fill=tree_pollen_color,
+                stroke_width=1, stroke_fill=sub_text_col1)
+    draw_text(tile, offset((allergen_xlocs[1]-5, allergen_yloc+50), origin), 
+                'WEED', font=get_font(18), fill=weed_pollen_color,
+                stroke_width=1, stroke_fill=sub_text_col1)
+    draw_text(tile, offset((allergen_xlocs[2]-5, allergen_yloc+50), origin), 
+                'GRASS', font=get_font(18), fill=grass_pollen_color,
+                stroke_width=1, stroke_fill=sub_text_col1)
+    draw_text(tile, offset((allergen_xlocs[3]-5, allergen_yloc+50), origin), 
+                'MOLD', font=get_font(18), fill=mold_spores_color,
+                stroke_width=1, stroke_fill=sub_text_col1)
+        
+    # place the air quality boxes
+    draw.rounded_rectangle(offset(today_ozone_coords, origin), outline=outline_color, 
+                            width=outline_width, radius=corner_radius,
+                            fill=oz_color)
+    draw.rounded_rectangle(offset(today_part_coords, origin), outline=outline_color, 
+                            width=outline_width, radius=corner_radius,
+                            fill=part_color)
+
+    draw.rounded_rectangle(offset(tomorrow_ozone_coords, origin), outline=outline_color, 
+                            width=outline_width, radius=corner_radius,
+                            fill=oz_fore_color)
+    draw.rounded_rectangle(offset(tomorrow_part_coords, origin), outline=outline_color, 
+                            width=outline_width, radius=corner_radius,
+                            fill=part_fore_color)
+
+
+def render_forecast_tile(tile, origin, forecast, debug=debug):
+    """
+    Lower quadrant, hourly and daily forecast
+    """
+    try:
+        if forecast is None:
+            raise ValueError("no weather data")
+        center_x = epd_width//2
+
+        hourly_xloc = lower_coords[0]+10
+        hourly_yloc = lower_coords[1]+5
+        x_bump = 48
+        for f in forecast["hourly"]:
+            hour = list(f.keys())[0]
+            temp = f[hour]["temp_f"]
+            id = f[hour]["id"] 
+            is_daytime = f[hour]["daytime"]
+
+            draw_text(tile, offset((hourly_xloc, hourly_yloc+50), origin), 
+                  hour, font=get_font(20), fill=sub_text_col1)
+            draw_text(tile, offset((hourly_xloc, hourly_yloc+90), origin), 
+                  str(temp)+'\N{DEGREE SIGN}', font=get_font(18), fill=sub_text_col1)
             
-                
-            ## Lower
-            try:
-                center_x = epd_width//2
-                box_top = lower_coords[1]
-                box_bottom = lower_coords[3]
-                
-                ## decorative divider lines
-                draw.line((center_x-6, box_top+50, center_x-6, box_bottom-10),
-                         fill=orange, width=4)
-                draw.line((center_x-2, box_top+50, center_x-2, box_bottom-10),
-                         fill=yellow, width=4)
-                draw.line((center_x+2, box_top+50, center_x+2, box_bottom-10),
-                         fill=red, width=4)
-
-                draw.text((lower_coords[0]+10, lower_coords[1]+5), 
-                          'HOURLY', font=nasa_font_20, fill=sub_text_col2)
-                draw.text((lower_coords[2]-75, lower_coords[1]+5), 
-                          'DAILY', font=nasa_font_20, fill=sub_text_col2)
-                
-                hourly_xloc = lower_coords[0]+10
-                hourly_yloc = lower_coords[1]+5
-                x_bump = 48
-                for f in weather_data["hourly"]:
-                    hour = list(f.keys())[0]
-                    temp = f[hour]["temp_f"]
-                    id = f[hour]["id"] 
-                    is_daytime = f[hour]["daytime"]
-
-                    draw.text((hourly_xloc, hourly_yloc+50), 
-                          hour, font=nasa_font_20, fill=sub_text_col1)
-                    draw.text((hourly_xloc, hourly_yloc+90), 
-                          str(temp)+'\N{DEGREE SIGN}', font=nasa_font_18, fill=sub_text_col1)
-                    
-                    with Image.open(get_condition_icon(id, is_daytime)) as condition_icon:
-                        newsize = (30,30)
-                        condition_icon = condition_icon.resize(newsize, Image.NEAREST)
-                        my_display.paste(condition_icon, (hourly_xloc, hourly_yloc+130))
-
-                    hourly_xloc = hourly_xloc + x_bump
-                    
-                daily_xloc = center_x+35
-                daily_yloc = lower_coords[1]+5
-                x_bump = 70
-                for f in weather_data["daily"]:
-                    day = list(f.keys())[0]
-                    max_temp = f[day]["max_temp"]
-                    min_temp = f[day]["min_temp"]
-                    id = f[day]["id"] 
-
-                    draw.text((daily_xloc, daily_yloc+30), 
-                          day, font=nasa_font_20, fill=sub_text_col1)
-                    draw.text((daily_xloc, daily_yloc+60), 
-                          "max", font=nasa_font_18, fill=sub_text_col1)
-                    draw.text((daily_xloc, daily_yloc+80), 
-                          str(max_temp)+'\N{DEGREE SIGN}', font=nasa_font_18, fill=sub_text_col1)
-                    draw.text((daily_xloc, daily_yloc+100), 
-                          "min", font=nasa_font_18, fill=sub_text_col1)
-                    draw.text((daily_xloc, daily_yloc+120), 
-                          str(min_temp)+'\N{DEGREE SIGN}', font=nasa_font_18, fill=sub_text_col1)
-
-                    with Image.open(get_condition_icon(id, is_daytime, daily=True)) as condition_icon:
-                        newsize = (45,45)
-                        condition_icon = condition_icon.resize(newsize, Image.NEAREST)
-                        my_display.paste(condition_icon, (daily_xloc, daily_yloc+160))
-
-                    daily_xloc = daily_xloc + x_bump
-                
-            except Exception as exception:
-                err_xloc = lower_coords[0]+50
-                err_yloc = lower_coords[1]+50
-                draw.text((err_xloc, err_yloc), "ERROR!", font=nasa_font_18, fill = red)
-                print(exception)
-                logging.exception("FAIL in daily/hourly section")
+            tile.paste(get_icon(get_condition_icon(id, is_daytime), (30,30), render_mode), 
+                       offset((hourly_xloc, hourly_yloc+130), origin))
+
+            hourly_xloc = hourly_xloc + x_bump
             
+        daily_xloc = center_x+35
+        daily_yloc = lower_coords[1]+5
+        x_bump = 70
+        for f in forecast["daily"]:
+            day = list(f.keys())[0]
+            max_temp = f[day]["max_temp"]
+            min_temp = f[day]["min_temp"]
+            id = f[day]["id"] 
+
+            draw_text(tile, offset((daily_xloc, daily_yloc+30), origin), 
+                  day, font=get_font(20), fill=sub_text_col1)
+            draw_text(tile, offset((daily_xloc, daily_yloc+60), origin), 
+                  "max", font=get_font(18), fill=sub_text_col1)
+            draw_text(tile, offset((daily_xloc, daily_yloc+80), origin), 
+                  str(max_temp)+'\N{DEGREE SIGN}', font=get_font(18), fill=sub_text_col1)
+            draw_text(tile, offset((daily_xloc, daily_yloc+100), origin), 
+                  "min", font=get_font(18), fill=sub_text_col1)
+            draw_text(tile, offset((daily_xloc, daily_yloc+120), origin), 
+                  str(min_temp)+'\N{DEGREE SIGN}', font=get_font(18), fill=sub_text_col1)
+
+            tile.paste(get_icon(get_condition_icon(id, True, daily=True), (45,45), render_mode), 
+                       offset((daily_xloc, daily_yloc+160), origin))
+
+            daily_xloc = daily_xloc + x_bump
+        
+    except Exception as exception:
+        err_xloc = lower_coords[0]+50
+        err_yloc = lower_coords[1]+50
+        draw_text(tile, offset((err_xloc, err_yloc), origin), "ERROR!", font=get_font(18), fill = red)
+        print(exception)
+        logging.exception("FAIL in daily/hourly section")
 
-            ##~~~~~~~~~~~~~
-            ## SEND DATA
-            if debug:
-                try:
-                    return my_display
-                finally:
-                    del my_display
-                    del draw
-            else:
-                epd.display(epd.getbuffer(my_display))
-                print("successful update at: ", datetime.now())
+
+## Rendered quadrant tiles by (profile, quadrant), keyed by
+## the data they were drawn from
+_tile_cache = {}
+
+
+def get_tile(name, coords, render, inputs, debug=debug):
+    """
+    Return the tile for a quadrant, only re-rendering it when
+    its slice of the data changed. Tiles start from the static
+    layer so the quadrant outlines and the logo stay intact
+    """
+    key = (data_fingerprint(inputs), debug)
+    cached = _tile_cache.get(name)
+    if cached is not None and cached[0] == key:
+        return cached[1]
+
+    box = (coords[0], coords[1], coords[2]+1, coords[3]+1)
+    tile = get_static_layer().crop(box)
+    render(tile, box[:2], *inputs, debug=debug)
+    _tile_cache[name] = (key, tile)
+    return tile
+
+
+def render_dashboard(dashboard_data, debug=debug, profile=None):
+    """
+    Composite the quadrant tiles for the fetched data onto
+    a copy of the static layer. The update time is left
+    off so the frame can be fingerprinted first
+    """
+    weather_data = dashboard_data["weather"]
+    if weather_data is None:
+        current = None
+        forecast = None
+    else:
+        current = weather_data["current"]
+        forecast = {"hourly": weather_data["hourly"], 
+                    "daily": weather_data["daily"]}
+    air_quality = dashboard_data["air_quality"]
+    if air_quality is not None:
+        ## the display only needs the four codes
+        air_quality = {k: air_quality.get(k) for k in ["ozone_code_current", "ozone_code_fore",
+                                                      "part_code_current", "part_code_fore"]}
+
+    quadrants = [
+        ("current", upper_left_coords, render_current_tile, (current,)),
+        ("allergen", upper_right_coords, render_allergen_tile, 
+            (dashboard_data["pollen"], air_quality, "pollen" not in dashboard_data.get("off", []))),
+        ("forecast", lower_coords, render_forecast_tile, (forecast,)),
+    ]
+
+    my_display = get_static_layer().copy()
+    for name, coords, render, inputs in quadrants:
+        tile = get_tile((profile, name), coords, render, inputs, debug=debug)
+        my_display.paste(tile, coords[:2])
+    draw_stale_labels(my_display, dashboard_data.get("stale") or {})
+
+    return my_display
+
+
+##~~~~~~~~~~~~~~~~~
+## RENDER POOL
+## With several profiles, frames render in parallel on worker
+## processes forked from this one, so they start out with the
+## icons loaded. Each worker keeps its own static layer, tile
+## and text caches. The pool is only forked at startup, before
+## any other thread runs; if a worker dies, frames render in
+## this process until it restarts
+
+_render_pool = None
+
+
+def render_pool_size():
+    return min(len(location_profiles), render_workers or os.cpu_count() or 1)
+
+
+def warm_render_worker():
+    get_static_layer()
+
+
+def start_render_pool():
+    """
+    Fork the render workers, None when one process is enough.
+    Call it before starting any threads, a worker forked while
+    another thread holds a lock can deadlock on it
+    """
+    global _render_pool
+    if _render_pool is None and render_pool_size() > 1:
+        _render_pool = ProcessPoolExecutor(render_pool_size(),
+                                           mp_context=multiprocessing.get_context("fork"))
+        ## the workers are forked on the first submit
+        for future in [_render_pool.submit(warm_render_worker) 
+                       for _ in range(render_pool_size())]:
+            future.result()
+    return _render_pool
+
+
+def stop_render_pool():
+    global _render_pool
+    if _render_pool is not None:
+        _render_pool.shutdown(cancel_futures=True)
+        _render_pool = None
+
+
+def render_frames(profile_data, debug=debug):
+    """
+    Render each profile's frame, on the render pool when it is
+    running and there is more than one. A frame that fails to
+    render is None
+    """
+    if _render_pool is not None and len(profile_data) > 1:
+        try:
+            return render_on_pool(_render_pool, profile_data, debug=debug)
+        except BrokenProcessPool:
+            ## e.g. a worker killed for memory. Forking again here, with
+            ## the collector and frame server threads running, could
+            ## deadlock, so render in this process from now on
+            logging.exception("render pool broken, rendering in this process until restart")
+            stop_render_pool()
+
+    frames = {}
+    for name, dashboard_data in profile_data.items():
+        try:
+            frames[name] = render_dashboard(dashboard_data, debug=debug, profile=name)
+        except Exception:
+            logging.exception("FAIL rendering %s", name)
+            frames[name] = None
+    return frames
+
+
+def render_on_pool(pool, profile_data, debug=debug):
+    """
+    render_frames on the render pool, raising BrokenProcessPool
+    if a worker died
+    """
+    futures = {name: pool.submit(render_dashboard, dashboard_data, debug, name)
+               for name, dashboard_data in profile_data.items()}
+    frames = {}
+    for name, future in futures.items():
+        try:
+            frames[name] = future.result()
+        except BrokenProcessPool:
+            raise
+        except Exception:
+            logging.exception("FAIL rendering %s", name)
+            frames[name] = None
+    return frames
+
+
+##~~~~~~~~~~~~~~~~~
+## REFRESH
+
+## A refresh's outcome is the first of these any profile had
+outcome_order = ["error", "updated", "rendered", "unchanged"]
+
+
+def make_display(debug=debug):
+    """
+    One refresh of the display. Stage timings go to the
+    refresh metrics, memory use too when instrumentation is on
+    """
+    start_timing()
+    start_refresh()
+    try:
+        return refresh_display(debug=debug)
+    finally:
+        end_refresh()
+        finish_timing()
+
+
+def refresh_display(debug=debug):
+    """
+    Draw every location profile from the latest snapshots and
+    send the frames that changed to their sinks. In debug the
+    frames are returned instead, {profile name: frame}
+    """
+    try:
+        with memory_stage("fetch"):
+            ## Draw from the collector's latest snapshots. Without a
+            ## collector (debug runs) fetch every source now, and
+            ## with one the sources it hasn't collected yet, bounded
+            ## by one deadline
+            sources = profile_sources(location_profiles, weather_api_key=weather_api_key,
+                                      airnow_api_key=airnow_api_key)
+            snapshots = latest_snapshots()
+            missing = sources
+            if collector_running():
+                missing = {key: fetch for key, fetch in sources.items() if key not in snapshots}
+            if missing:
+                collect_once(missing, fetch_sources)
+                snapshots = latest_snapshots()
+            ## the collector's fetches aren't stages of this refresh,
+            ## report how each source's last collection went instead
+            note_sources(source_metrics(sources))
+            del sources, missing
+
+            if not snapshots:
+                ## nothing to draw, check the internet connection
+                with timed("connectivity"):
+                    if not internet_available():
+                        raise ConnectionError("no data and no internet connection")
+
+    except ConnectionError as exception:
+        logging.exception("FAIL in internet connection test")
+        note_outcome("offline")
+        print(exception)
+        return show_error("no internet connection", location_profiles, debug=debug)
+
+    with memory_stage("parse"):
+        profile_data = parse_profile_data(location_profiles, {key: snapshot["data"] 
+                                                              for key, snapshot in snapshots.items()})
+        for profile in location_profiles:
+            profile_data[profile.name]["stale"] = stale_labels({
+                source: snapshots[key] for source, key in source_keys(profile).items() 
+                if key in snapshots})
+        del snapshots
+
+    return update_profiles(profile_data, debug=debug)
+
+
+def update_profiles(profile_data, debug=debug):
+    """
+    Render the profiles whose data changed and send each
+    frame that changed to its profile's sink
+    """
+    profiles = {profile.name: profile for profile in location_profiles}
+    outcomes = {}
+    data_fps = {}
+
+    ## Skip the profiles whose data hasn't changed
+    for name, dashboard_data in profile_data.items():
+        data_fps[name] = data_fingerprint(dashboard_data)
+        if not debug and data_fps[name] == load_display_state(name).get("data"):
+            logging.info("%s data unchanged, skipping update", name)
+            outcomes[name] = "unchanged"
+
+    ## Draw canvases
+    with memory_stage("render"), timed("render"):
+        rendered = render_frames({name: dashboard_data for name, dashboard_data 
+                                  in profile_data.items() if name not in outcomes}, debug=debug)
+
+    ##~~~~~~~~~~~~~
+    ## SEND DATA
+    frames = {}
+    for name, my_display in rendered.items():
+        try:
+            if my_display is None:
+                raise RuntimeError("no frame rendered for " + name)
+            frame_fp = frame_fingerprint(my_display)
+            if not debug and frame_fp == load_display_state(name).get("frame"):
+                logging.info("%s frame unchanged, skipping update", name)
+                outcomes[name] = "unchanged"
+                save_display_state(name, data_fps[name], frame_fp)
                 my_display.close()
+                continue
+            draw_update_time(my_display)
 
-                # cleanup to address OOM error
-                del my_display
-                del draw
-            
-        except Exception as exception:
-            logging.exception("FAIL in canvas or data transfer")
-            err_display = Image.new("RGB", (epd_width, epd_height), white)
-            draw = ImageDraw.Draw(err_display)
-            draw.text((369,240), "ERROR!", font=nasa_font_28, fill = red)
-            draw.text((349,280), "failed initialization", font=nasa_font_18, fill = red)
             if debug:
-                return err_display
-            else:
-                epd.init()
-                epd.Clear()
-                epd.display(epd.getbuffer(err_display))
+                outcomes[name] = "rendered"
+                frames[name] = my_display
+                continue
+            profile_sink(profiles[name]).send(my_display)
+            outcomes[name] = "updated"
+            save_display_state(name, data_fps[name], frame_fp)
+            print("successful update of {} at: ".format(name), datetime.now())
+            my_display.close()
+
+        except Exception as exception:
+            logging.exception("FAIL in canvas or data transfer for %s", name)
+            outcomes[name] = "error"
             print(exception)
-            err_display.close()
-        
-    except (requests.ConnectionError, requests.Timeout) as exception:
-        logging.exception("FAIL in internet connection test")
-        err_display = Image.new("RGB", (epd_width, epd_height), white)
-        draw = ImageDraw.Draw(err_display)
-        draw.text((369,240), "ERROR!", font=nasa_font_28, fill = red)
-        draw.text((349,280), "no internet connection", font=nasa_font_18, fill = red)
+            frames.update(show_error("failed initialization", [profiles[name]], debug=debug))
+
+    note_outcome(min(outcomes.values(), key=outcome_order.index, default="unchanged"))
+    if debug:
+        return frames
+
+
+def show_error(message, profiles, debug=debug):
+    """
+    Show an error frame on each profile's sink, in debug the
+    frames are returned instead, {profile name: frame}
+    """
+    frames = {}
+    for profile in profiles:
+        err_display = new_canvas()
+        draw = new_draw(err_display)
+        draw.text((369,240), "ERROR!", font=get_font(28), fill = red)
+        draw.text((349,280), message, font=get_font(18), fill = red)
         if debug:
-                return err_display
-        else:
-            epd.init()
-            epd.Clear()
-            epd.display(epd.getbuffer(err_display))
-        print(exception)
+            frames[profile.name] = err_display
+            continue
+        try:
+            profile_sink(profile).send(err_display)
+        except Exception:
+            logging.exception("FAIL showing error frame for %s", profile.name)
+        clear_display_state(profile.name)
         err_display.close()
+    return frames
         
 
 ##~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
 ## EXECUTE
     
-def clear_and_pause(pause_time = 25200):
+def start_quiet_hours():
     """
-    Clear display and pause execution, default is 7 hours
+    Clear the display for the night, refreshes are skipped
+    until quiet hours end
     """
-    epd.Clear()
+    clear_sinks()
     print("daily pause...")
-    time.sleep(pause_time)
-    
+
+
+def clear_sinks():
+    """
+    Blank every profile's sink
+    """
+    for sink in set(profile_sink(profile) for profile in location_profiles):
+        sink.clear()
+    clear_display_state()
+
+
+def shutdown_panel():
+    """
+    Stop collecting and rendering, clear the sinks and
+    release the panel's pins
+    """
+    stop_collector()
+    stop_frame_server()
+    close_sessions()
+    stop_render_pool()
+    clear_sinks()
+    close_sinks(profile_sink(profile) for profile in location_profiles)
+
+
+def make_scheduler():
+    """
+    Refresh on the hour and half hour, outside quiet hours
+    """
+    scheduler = Scheduler(quiet_hours=quiet_hours)
+    scheduler.add(Job("refresh", make_display, hourly_at(0, 30), refresh_timeout))
+    scheduler.add(Job("quiet hours", start_quiet_hours, daily_at(quiet_hours[0]), 
+                      clear_timeout, during_quiet_hours=True))
+    return scheduler
+
+
 
 def weather_display():
+    mark("imported")
+    if memory_instrumentation:
+        enable_memory_instrumentation()
+    preload_icons(render_mode)
+    ## before any thread starts, see start_render_pool
+    start_render_pool()
     if debug:
-        debug_img = make_display(debug=debug)
-        debug_img.save(debug_save_location, quality=100, subsampling=0)
+        frames = make_display(debug=debug)
+        stop_render_pool()
+        for i, profile in enumerate(location_profiles):
+            debug_img = frames[profile.name]
+            save_location = debug_save_location
+            if i > 0:
+                root, ext = os.path.splitext(debug_save_location)
+                save_location = "{}_{}{}".format(root, profile.name, ext)
+            if save_location.lower().endswith((".jpg", ".jpeg")):
+                ## JPEG has no palette mode
+                debug_img = debug_img.convert("RGB")
+            debug_img.save(save_location, quality=100, subsampling=0)
 
     else:
         try:
+            wait_until_ready(readiness_timeout, 
+                             need_spi=any(profile.sink == "epd" for profile in location_profiles))
+            mark("ready")
+            served = [profile for profile in location_profiles if profile.sink == "http"]
+            if served:
+                ## served frames don't outlive the process, send them again
+                for profile in served:
+                    clear_display_state(profile.name)
+                start_frame_server()
+            start_collector(profile_sources(location_profiles, 
+                                            weather_api_key=weather_api_key,
+                                            airnow_api_key=airnow_api_key))
             make_display(debug=debug)
-            schedule.every().hour.at(":00").do(make_display)
-            schedule.every().hour.at(":30").do(make_display)
-            schedule.every().day.at("23:00").do(clear_and_pause)
-            while True:
-                schedule.run_pending()
-                time.sleep(1)
+            mark("first frame")
+            report_startup()
+
+            scheduler = make_scheduler()
+            scheduler.install_signal_handlers("refresh")
+            scheduler.run()
+
+            ## stopped by SIGTERM/SIGINT
+            shutdown_panel()
         except KeyboardInterrupt:
-            epd.Clear()
-            epaper.epaper(epap_model).epdconfig.module_exit(cleanup=True)
+            shutdown_panel()
             
         except Exception as exception:
             logging.exception("FAIL in main function")
@@ -499,8 +953,7 @@ def weather_display():
             if type(exception).__name__ == "OSError":
                 os.system("sudo reboot")
 
-            epd.init()
-            epd.Clear()
+            clear_sinks()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,148 @@
+import io
+import json
+import logging
+import threading
+import time
+from collections import namedtuple
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from framebuffer import pack_frame, numpy_available
+from frame_state import frame_fingerprint
+from palette import to_panel_colors
+
+##~~~~~~~~~~~~~~~~~
+## FRAME SERVER
+## Serves the latest frame of each "http" sink profile so thin
+## panel controllers pull a finished frame instead of fetching
+## and rendering their own:
+##   /<profile>.png  indexed PNG, palette index = panel colour
+##   /<profile>.bin  packed buffer, ready for epd.display
+##   /               {profile: {"etag", "updated"}} as JSON
+## Every frame has an ETag, a client sending it back in
+## If-None-Match gets a 304 until the frame changes
+
+frame_server_host = "0.0.0.0"
+frame_server_port = 8080
+
+PublishedFrame = namedtuple("PublishedFrame", ["etag", "png", "packed", "updated"])
+
+_frames = {}
+_frames_lock = threading.Lock()
+_server = None
+
+
+def publish_frame(name, image):
+    """
+    Make image the frame served for name, encoded once here
+    rather than on every request
+    """
+    if image.mode != "P":
+        image = to_panel_colors(image)
+    png = io.BytesIO()
+    ## 4 bit indices keep the panel palette order, 7 colours fit
+    image.save(png, format="PNG", bits=4)
+    packed = None
+    if numpy_available():
+        packed = bytes(pack_frame(image, *image.size))
+    frame = PublishedFrame(etag='"{}"'.format(frame_fingerprint(image)), png=png.getvalue(),
+                           packed=packed, updated=time.time())
+    with _frames_lock:
+        _frames[name] = frame
+
+
+def published_frames():
+    with _frames_lock:
+        return dict(_frames)
+
+
+def etag_matches(if_none_match, etag):
+    """
+    Whether an If-None-Match header covers etag, weak
+    comparison as RFC 9110 asks for
+    """
+    if if_none_match is None:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    tags = [tag.strip() for tag in if_none_match.split(",")]
+    return any(tag[2:] == etag if tag.startswith("W/") else tag == etag for tag in tags)
+
+
+class FrameRequestHandler(BaseHTTPRequestHandler):
+
+    server_version = "EpaperFrameServer/1.0"
+
+    def do_HEAD(self):
+        self.respond(send_body=False)
+
+    def do_GET(self):
+        self.respond(send_body=True)
+
+    def respond(self, send_body):
+        path = self.path.split("?", 1)[0]
+        frames = published_frames()
+        if path == "/":
+            index = {name: {"etag": frame.etag, "updated": round(frame.updated, 3)}
+                     for name, frame in frames.items()}
+            self.send_body(200, "application/json", json.dumps(index).encode(), send_body)
+            return
+
+        name, _, extension = path[1:].rpartition(".")
+        frame = frames.get(name)
+        if frame is None or extension not in ("png", "bin"):
+            self.send_body(404, "text/plain", b"no such frame\n", send_body)
+            return
+        if extension == "bin" and frame.packed is None:
+            self.send_body(503, "text/plain", b"packed frames need numpy\n", send_body)
+            return
+
+        if etag_matches(self.headers.get("If-None-Match"), frame.etag):
+            self.send_response(304)
+            self.send_header("ETag", frame.etag)
+            self.send_header("Cache-Control", "no-cache")
+            self.end_headers()
+            return
+        if extension == "png":
+            body, content_type = frame.png, "image/png"
+        else:
+            body, content_type = frame.packed, "application/octet-stream"
+        self.send_body(200, content_type, body, send_body, etag=frame.etag)
+
+    def send_body(self, status, content_type, body, send_body, etag=None):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        ## clients revalidate every time, a 304 costs next to nothing
+        self.send_header("Cache-Control", "no-cache")
+        if etag is not None:
+            self.send_header("ETag", etag)
+        self.end_headers()
+        if send_body:
+            self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        logging.debug("frame server: %s %s", self.address_string(), format % args)
+
+
+def start_frame_server(host=None, port=None):
+    """
+    Serve frames on a background thread, once
+    """
+    global _server
+    if _server is not None:
+        return _server
+    address = (frame_server_host if host is None else host,
+               frame_server_port if port is None else port)
+    _server = ThreadingHTTPServer(address, FrameRequestHandler)
+    _server.daemon_threads = True
+    thread = threading.Thread(target=_server.serve_forever, name="frame-server", daemon=True)
+    thread.start()
+    logging.info("frame server listening on %s:%d", *_server.server_address[:2])
+    return _server
+
+
+def stop_frame_server():
+    global _server
+    if _server is not None:
+        _server.shutdown()
+        _server.server_close()
+        _server = None
@@ -0,0 +1,98 @@
+import hashlib
+import json
+import os
+
+##~~~~~~~~~~~~~~~~~
+## FRAME FINGERPRINTS
+## Fingerprints of the data and of the rendered frame from the
+## last update of each profile's sink, kept on disk so an
+## unchanged frame isn't sent to the panel again, even across
+## restarts
+
+display_state_path = "./cache/display_state.json"
+
+
+def _jsonable(obj):
+    """
+    Make nested data JSON friendly, e.g. the tuple keyed
+    AirNow forecast index
+    """
+    if isinstance(obj, dict):
+        return {str(k): _jsonable(v) for k, v in obj.items()}
+    if isinstance(obj, (list, tuple)):
+        return [_jsonable(v) for v in obj]
+    return obj
+
+
+def data_fingerprint(data):
+    """
+    Fingerprint of the data model behind a frame
+    """
+    text = json.dumps(_jsonable(data), sort_keys=True, default=str)
+    return hashlib.sha1(text.encode()).hexdigest()
+
+
+def frame_fingerprint(image):
+    """
+    Fingerprint of the rendered pixels, which fully
+    determine the packed panel buffer
+    """
+    digest = hashlib.sha1()
+    digest.update("{}{}".format(image.mode, image.size).encode())
+    digest.update(image.tobytes())
+    return digest.hexdigest()
+
+
+def _read_states():
+    """
+    Fingerprints by profile, a state file from before profiles
+    (a single {"data", "frame"}) reads as empty
+    """
+    try:
+        with open(display_state_path) as f:
+            states = json.load(f)
+    except (OSError, ValueError):
+        return {}
+    if not isinstance(states, dict):
+        return {}
+    return {profile: state for profile, state in states.items() if isinstance(state, dict)}
+
+
+def _write_states(states):
+    os.makedirs(os.path.dirname(display_state_path), exist_ok=True)
+    tmp_path = display_state_path + ".tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(states, f)
+    os.replace(tmp_path, display_state_path)
+
+
+def load_display_state(profile):
+    """
+    Fingerprints of the frame currently on a profile's sink
+    """
+    return _read_states().get(profile, {})
+
+
+def save_display_state(profile, data_fp, frame_fp):
+    """
+    Remember what was just sent to a profile's sink
+    """
+    states = _read_states()
+    states[profile] = {"data": data_fp, "frame": frame_fp}
+    _write_states(states)
+
+
+def clear_display_state(profile=None):
+    """
+    Forget a profile's sink contents, or every profile's,
+    e.g. after showing an error or clearing the panel
+    """
+    if profile is None:
+        try:
+            os.remove(display_state_path)
+        except OSError:
+            pass
+        return
+    states = _read_states()
+    if states.pop(profile, None) is not None:
+        _write_states(states)
@@ -0,0 +1,68 @@
+from palette import panel_palette, palette_data, to_panel_colors
+
+## numpy is imported with the first frame, not at startup
+np = None
+_numpy_missing = False
+
+##~~~~~~~~~~~~~~~~~
+## FRAME BUFFER PACKING
+## NumPy replacement for epd.getbuffer. Pixels are mapped to
+## panel colour indices through a lookup table and packed two
+## per byte (4 bits each), high nibble first. Frames that use
+## colours outside the panel palette go through the same PIL
+## quantize as getbuffer, so the buffer is byte-identical
+
+def numpy_available():
+    """
+    Import numpy on first use, False if it isn't installed
+    """
+    global np, _numpy_missing, _key_order, _sorted_keys
+    if np is None and not _numpy_missing:
+        try:
+            import numpy
+        except ImportError:
+            _numpy_missing = True
+            return False
+        ## RGB packed into one integer per palette entry, sorted for searchsorted
+        palette_keys = numpy.array([(r << 16) | (g << 8) | b for _, (r, g, b) in panel_palette],
+                                   dtype=numpy.uint32)
+        _key_order = numpy.argsort(palette_keys)
+        _sorted_keys = palette_keys[_key_order]
+        np = numpy
+    return np is not None
+
+
+def palette_indices(image):
+    """
+    Panel colour index of every pixel, row major
+    """
+    palette_size = 3*len(panel_palette)
+    if image.mode == "P" and image.getpalette()[:palette_size] == palette_data()[:palette_size]:
+        ## already indexed on the panel palette
+        indices = np.frombuffer(image.tobytes(), dtype=np.uint8)
+        if indices.max(initial=0) < len(panel_palette):
+            return indices
+
+    rgb = np.frombuffer(image.convert("RGB").tobytes(), dtype=np.uint8).reshape(-1, 3)
+    keys = (rgb[:, 0].astype(np.uint32) << 16) | (rgb[:, 1].astype(np.uint32) << 8) | rgb[:, 2]
+    pos = np.searchsorted(_sorted_keys, keys)
+    pos = np.minimum(pos, len(_sorted_keys)-1)
+    if np.array_equal(_sorted_keys[pos], keys):
+        return _key_order[pos].astype(np.uint8)
+
+    ## not palette-exact, dither like getbuffer does
+    return np.frombuffer(to_panel_colors(image).tobytes(), dtype=np.uint8)
+
+
+def pack_frame(image, width, height):
+    """
+    Pack a frame for epd.display, rotating portrait frames
+    the same way getbuffer does
+    """
+    if not numpy_available():
+        raise ImportError("pack_frame needs numpy")
+    if image.size == (height, width) and width != height:
+        image = image.rotate(90, expand=True)
+    indices = palette_indices(image)
+    packed = (indices[0::2] << 4) | indices[1::2]
+    return bytearray(packed.tobytes())
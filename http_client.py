@@ -0,0 +1,105 @@
+from urllib.parse import urlsplit
+import threading
+from metrics import timed
+
+##~~~~~~~~~~~~~~~~~
+## POOLED HTTP CLIENT
+## One long-lived keep-alive session per host, shared by
+## every data source for the life of the process, so DNS,
+## TCP and TLS handshakes aren't paid on each refresh
+
+## connections kept open per host
+pool_maxsize = 4
+
+## requests is imported with the first session, not at startup
+
+## retry with backoff on server errors. A timed out read isn't
+## retried and a failed connect only once, or a source's
+## timeouts would multiply past the fetch deadline
+retry_total = 2
+retry_connect = 1
+retry_read = 0
+retry_backoff = 0.5
+retry_statuses = [429, 500, 502, 503, 504]
+
+_sessions = {}
+_sessions_lock = threading.Lock()
+
+
+def make_session():
+    """
+    Create a session with a bounded connection pool,
+    retries with backoff and gzip negotiation
+    """
+    import requests
+    from requests.adapters import HTTPAdapter
+    from urllib3.util.retry import Retry
+
+    retries = Retry(total=retry_total,
+                    connect=retry_connect,
+                    read=retry_read,
+                    backoff_factor=retry_backoff,
+                    status_forcelist=retry_statuses,
+                    allowed_methods=["GET", "HEAD"],
+                    raise_on_status=False)
+    adapter = HTTPAdapter(pool_connections=1,
+                          pool_maxsize=pool_maxsize,
+                          max_retries=retries)
+    session = requests.Session()
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    session.headers["Accept-Encoding"] = "gzip, deflate"
+    return session
+
+
+def get_session(url):
+    """
+    Return the shared session for the url's host,
+    creating it on first use
+    """
+    parts = urlsplit(url)
+    host = parts.scheme + "://" + parts.netloc
+    with _sessions_lock:
+        session = _sessions.get(host)
+        if session is None:
+            session = make_session()
+            _sessions[host] = session
+    return session
+
+
+def http_get(url, **kwargs):
+    """
+    GET through the pooled session for the url's host
+    """
+    with timed("http GET " + urlsplit(url).netloc):
+        return get_session(url).get(url, **kwargs)
+
+
+def http_head(url, **kwargs):
+    """
+    HEAD through the pooled session for the url's host
+    """
+    with timed("http HEAD " + urlsplit(url).netloc):
+        return get_session(url).head(url, **kwargs)
+
+
+def close_sessions():
+    """
+    Close every pooled session, e.g. on shutdown
+    """
+    with _sessions_lock:
+        for session in _sessions.values():
+            session.close()
+        _sessions.clear()
+
+
+def internet_available(url="http://www.google.com", timeout=5):
+    """
+    Whether a well known site answers
+    """
+    import requests
+    try:
+        with http_get(url, timeout=timeout):
+            return True
+    except (requests.ConnectionError, requests.Timeout):
+        return False
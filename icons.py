@@ -0,0 +1,180 @@
+from PIL import Image
+from collections import OrderedDict
+import json
+import logging
+import mmap
+import struct
+import threading
+from palette import to_panel_colors
+
+##~~~~~~~~~~~~~~~~~
+## ICON CACHE
+## Icons are decoded and resized once per (path, size) and
+## kept in memory, least recently used ones are dropped once
+## the cache grows past icon_cache_budget bytes
+
+icon_cache_budget = 4*1024*1024
+
+## Current weather icons based on weather id, see
+## dashboard_data.get_condition_icon
+curr_weather_icons = {
+    "clear": "./icons/sun.bmp",
+    "clear_night": "./icons/night.bmp",
+    "partly cloudy": "./icons/partly_cloudy.bmp",
+    "partly cloudy night": "./icons/partly_cloudy_night.bmp",
+    "mostly cloudy": "./icons/mostly_cloudy.bmp",
+    "light rain": "./icons/light_rain.bmp",
+    "rain": "./icons/rain.bmp",
+    "thunderstorm": "./icons/thunder.bmp",
+    "snow": "./icons/snow.bmp",
+    "atmospheric": "./icons/atm.bmp",
+}
+
+## Every icon the dashboard draws, by size
+condition_icon_paths = sorted(set(curr_weather_icons.values()))
+thermometer_icon_paths = ["./icons/thermo_hi.bmp",
+                          "./icons/thermo_low.bmp",
+                          "./icons/thermo_mid.bmp"]
+small_icon_paths = ["./icons/humidity.bmp",
+                    "./icons/uv.bmp",
+                    "./icons/uv_low.bmp",
+                    "./icons/uv_medium.bmp",
+                    "./icons/uv_moderate.bmp",
+                    "./icons/uv_high.bmp",
+                    "./icons/tree.bmp",
+                    "./icons/weed.bmp",
+                    "./icons/grass.bmp",
+                    "./icons/mold.bmp"]
+icon_manifest = {
+    (100,100): condition_icon_paths,
+    (45,45): condition_icon_paths,
+    (30,30): condition_icon_paths,
+    (50,110): thermometer_icon_paths,
+    (40,40): small_icon_paths,
+    (90,90): ["./icons/astros.bmp"],
+}
+
+## Prebuilt palette-native icons, see build_icon_pack.py.
+## Icons missing from the pack fall back to the BMPs
+icon_pack_path = "./icons/icons.pack"
+icon_pack_magic = b"EPAK"
+
+_icon_pack = None
+_icon_pack_index = {}
+_icon_pack_palette = None
+
+_icon_cache = OrderedDict()
+_icon_cache_bytes = 0
+_icon_cache_lock = threading.Lock()
+
+
+def image_bytes(image):
+    """
+    Approximate memory held by an image
+    """
+    return image.width * image.height * len(image.getbands())
+
+
+def load_icon(path, size):
+    """
+    Decode an icon and resize it for pasting
+    """
+    with Image.open(path) as icon:
+        return icon.resize(size, Image.NEAREST)
+
+
+def icon_pack_key(path, size):
+    return "{}|{}x{}".format(path, size[0], size[1])
+
+
+def load_icon_pack(path=icon_pack_path):
+    """
+    Map the icon pack into memory, returns False if
+    there is no usable pack
+    """
+    global _icon_pack, _icon_pack_index, _icon_pack_palette
+    try:
+        with open(path, "rb") as f:
+            pack = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    except (OSError, ValueError):
+        return False
+
+    if pack[:len(icon_pack_magic)] != icon_pack_magic:
+        logging.warning("ignoring %s, not an icon pack", path)
+        pack.close()
+        return False
+    start = len(icon_pack_magic)
+    (header_len,) = struct.unpack("<I", pack[start:start+4])
+    header = json.loads(pack[start+4:start+4+header_len])
+    data_start = start + 4 + header_len
+
+    _icon_pack = memoryview(pack)[data_start:]
+    _icon_pack_index = header["icons"]
+    _icon_pack_palette = header["palette"]
+    return True
+
+
+def pack_icon(path, size):
+    """
+    Return the prebuilt "P" mode icon, None if it isn't in the pack
+    """
+    entry = _icon_pack_index.get(icon_pack_key(path, size))
+    if entry is None:
+        return None
+    offset, width, height = entry
+    data = _icon_pack[offset:offset+width*height]
+    icon = Image.frombuffer("P", (width, height), data, "raw", "P", 0, 1)
+    icon.putpalette(_icon_pack_palette)
+    return icon
+
+
+def get_icon(path, size, mode=None):
+    """
+    Return the icon at path resized to size, from the
+    cache when possible. Pass mode="P" for an icon on the
+    panel palette, ready to paste onto a "P" canvas. The
+    returned image is shared, only paste it, don't draw on it
+    """
+    global _icon_cache_bytes
+    key = (path, size, mode)
+    with _icon_cache_lock:
+        icon = _icon_cache.get(key)
+        if icon is not None:
+            _icon_cache.move_to_end(key)
+            return icon
+
+    icon = None
+    if _icon_pack is not None:
+        icon = pack_icon(path, size)
+    if icon is None:
+        icon = load_icon(path, size)
+        if mode == "P":
+            icon = to_panel_colors(icon)
+
+    with _icon_cache_lock:
+        if key not in _icon_cache:
+            _icon_cache[key] = icon
+            _icon_cache_bytes += image_bytes(icon)
+        while _icon_cache_bytes > icon_cache_budget and len(_icon_cache) > 1:
+            _, evicted = _icon_cache.popitem(last=False)
+            _icon_cache_bytes -= image_bytes(evicted)
+
+    return icon
+
+
+def preload_icons(mode=None):
+    """
+    Map the icon pack if there is one, then fill the
+    cache with every icon in icon_manifest
+    """
+    load_icon_pack()
+    for size, paths in icon_manifest.items():
+        for path in paths:
+            get_icon(path, size, mode)
+
+
+def clear_icon_cache():
+    global _icon_cache_bytes
+    with _icon_cache_lock:
+        _icon_cache.clear()
+        _icon_cache_bytes = 0
@@ -0,0 +1,116 @@
+import logging
+import os
+import resource
+import tracemalloc
+from contextlib import contextmanager
+
+##~~~~~~~~~~~~~~~~~
+## MEMORY INSTRUMENTATION
+## Optional tracemalloc and RSS sampling around each refresh
+## stage (fetch, parse, render, buffer, display). Peak and
+## retained memory per stage go to the log, and a warning is
+## logged once retained memory has grown by more than
+## leak_min_growth bytes for leak_warn_refreshes refreshes in a
+## row, with the allocations that grew the most since the run began
+
+leak_warn_refreshes = 5
+leak_min_growth = 16 * 1024
+leak_report_lines = 5
+
+_enabled = False
+_refresh = None
+_growth_run = []
+_baseline_snapshot = None
+_warned = False
+
+
+def enable_memory_instrumentation(frames=1):
+    """
+    Start tracing allocations, keeping frames of traceback each
+    """
+    global _enabled
+    if not tracemalloc.is_tracing():
+        tracemalloc.start(frames)
+    _enabled = True
+
+
+def rss_bytes():
+    """
+    Resident set size of this process
+    """
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        ## peak rather than current RSS, in KiB on linux
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def kib(n):
+    return "{:.1f} KiB".format(n / 1024)
+
+
+def start_refresh():
+    """
+    Begin recording a refresh
+    """
+    global _refresh
+    if not _enabled:
+        return
+    current, _ = tracemalloc.get_traced_memory()
+    _refresh = {"start": current, "rss_start": rss_bytes(), "stages": []}
+
+
+@contextmanager
+def memory_stage(name):
+    """
+    Record peak and retained traced memory of a stage
+    """
+    if not _enabled or _refresh is None:
+        yield
+        return
+    tracemalloc.reset_peak()
+    before, _ = tracemalloc.get_traced_memory()
+    try:
+        yield
+    finally:
+        after, peak = tracemalloc.get_traced_memory()
+        _refresh["stages"].append((name, peak - before, after - before, rss_bytes()))
+
+
+def end_refresh():
+    """
+    Log the refresh's stages and check for growth across refreshes
+    """
+    global _refresh, _baseline_snapshot, _warned
+    if not _enabled or _refresh is None:
+        return
+    current, _ = tracemalloc.get_traced_memory()
+    rss = rss_bytes()
+    for name, peak, retained, stage_rss in _refresh["stages"]:
+        logging.info("memory %s: peak +%s, retained %+d B, rss %s",
+                     name, kib(peak), retained, kib(stage_rss))
+    retained = current - _refresh["start"]
+    logging.info("memory refresh: retained %+d B, traced %s, rss %s (%+d B)",
+                 retained, kib(current), kib(rss), rss - _refresh["rss_start"])
+    _refresh = None
+
+    if retained <= leak_min_growth:
+        ## caches filling up grow a little, only a steady climb counts
+        del _growth_run[:]
+        _baseline_snapshot = None
+        _warned = False
+        return
+    if not _growth_run:
+        ## a growth run starts here, compare it against this point
+        _baseline_snapshot = tracemalloc.take_snapshot()
+    _growth_run.append(retained)
+
+    if len(_growth_run) >= leak_warn_refreshes and not _warned:
+        snapshot = tracemalloc.take_snapshot()
+        stats = snapshot.compare_to(_baseline_snapshot, "lineno")[:leak_report_lines]
+        logging.warning("memory grew %s over the last %d refreshes, possible leak, "
+                        "grown most since the first of them:\n%s",
+                        kib(sum(_growth_run)), len(_growth_run),
+                        "\n".join(str(stat) for stat in stats))
+        _warned = True
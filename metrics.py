@@ -0,0 +1,192 @@
+import json
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+##~~~~~~~~~~~~~~~~~
+## REFRESH METRICS
+## Wall-clock timings of every stage of a refresh (connectivity
+## check, each fetch and HTTP request, each parse, rendering,
+## buffer packing and epd.display). Each refresh is appended
+## as one line to a rolling JSON-lines file and the latest one
+## is written as a Prometheus textfile-collector file.
+## A refresh only collects timings from its own thread and the
+## threads it hands work to (carry_timing), the background
+## collector's fetches are reported per source instead
+
+metrics_dir = "./metrics"
+
+## one JSON object per refresh, rolled over to .1 past max bytes
+metrics_log_path = metrics_dir + "/refresh_metrics.jsonl"
+metrics_log_max_bytes = 1000000
+
+## point node_exporter's --collector.textfile.directory here,
+## None turns the file off
+prometheus_textfile_path = metrics_dir + "/epaper_dashboard.prom"
+
+_lock = threading.Lock()
+_local = threading.local()
+_outcomes = {}
+
+
+def current_refresh():
+    return getattr(_local, "refresh", None)
+
+
+def start_timing():
+    """
+    Begin timing a refresh
+    """
+    _local.refresh = {"start": time.time(), "clock": time.perf_counter(),
+                      "outcome": "unknown", "stages": {}, "calls": {}, "sources": {}}
+
+
+@contextmanager
+def timed(name):
+    """
+    Time a stage of the current refresh. Safe to use from the
+    fetch threads, a stage run more than once (e.g. two requests
+    to one host) adds up its time and counts its calls
+    """
+    refresh = current_refresh()
+    if refresh is None:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        with _lock:
+            refresh["stages"][name] = refresh["stages"].get(name, 0) + elapsed
+            refresh["calls"][name] = refresh["calls"].get(name, 0) + 1
+
+
+def carry_timing(func):
+    """
+    Wrap func, to be run on another thread, so its stages are
+    timed into the calling thread's refresh
+    """
+    refresh = current_refresh()
+
+    def run(*args, **kwargs):
+        previous = current_refresh()
+        _local.refresh = refresh
+        try:
+            return func(*args, **kwargs)
+        finally:
+            _local.refresh = previous
+    return run
+
+
+def note_outcome(outcome):
+    """
+    Record how the refresh ended, e.g. "updated" or "unchanged"
+    """
+    refresh = current_refresh()
+    if refresh is not None:
+        refresh["outcome"] = outcome
+
+
+def note_sources(sources):
+    """
+    Record each source's last collection and data age,
+    {source: {"fetch_seconds", "fetch_ok", "age_seconds"}}
+    """
+    refresh = current_refresh()
+    if refresh is not None:
+        refresh["sources"] = sources
+
+
+def finish_timing():
+    """
+    Write out the timings of the current refresh
+    """
+    refresh = current_refresh()
+    _local.refresh = None
+    if refresh is None:
+        return None
+
+    record = {
+        "time": round(refresh["start"], 3),
+        "outcome": refresh["outcome"],
+        "seconds": round(time.perf_counter() - refresh["clock"], 4),
+        "stages": {name: round(seconds, 4) for name, seconds in refresh["stages"].items()},
+        "calls": {name: n for name, n in refresh["calls"].items() if n > 1},
+        "sources": refresh["sources"],
+    }
+    _outcomes[record["outcome"]] = _outcomes.get(record["outcome"], 0) + 1
+
+    try:
+        if metrics_log_path:
+            append_record(record)
+        if prometheus_textfile_path:
+            write_textfile(record)
+    except OSError:
+        logging.exception("FAIL writing refresh metrics")
+    return record
+
+
+def append_record(record):
+    """
+    Append to the JSON-lines file, rolling it over when full
+    """
+    os.makedirs(os.path.dirname(metrics_log_path), exist_ok=True)
+    try:
+        if os.path.getsize(metrics_log_path) >= metrics_log_max_bytes:
+            os.replace(metrics_log_path, metrics_log_path + ".1")
+    except OSError:
+        pass
+    with open(metrics_log_path, "a") as f:
+        f.write(json.dumps(record) + "\n")
+
+
+def label(value):
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def write_textfile(record):
+    """
+    Atomically replace the textfile-collector file with the
+    latest refresh, node_exporter may read it at any time
+    """
+    lines = [
+        "# HELP epaper_refresh_seconds Wall-clock seconds of the last refresh",
+        "# TYPE epaper_refresh_seconds gauge",
+        "epaper_refresh_seconds {}".format(record["seconds"]),
+        "# HELP epaper_refresh_timestamp_seconds When the last refresh started",
+        "# TYPE epaper_refresh_timestamp_seconds gauge",
+        "epaper_refresh_timestamp_seconds {}".format(record["time"]),
+        "# HELP epaper_refresh_stage_seconds Wall-clock seconds per stage of the last refresh",
+        "# TYPE epaper_refresh_stage_seconds gauge",
+    ]
+    for name, seconds in sorted(record["stages"].items()):
+        lines.append('epaper_refresh_stage_seconds{{stage="{}"}} {}'.format(label(name), seconds))
+    source_gauges = [
+        ("fetch_seconds", "epaper_source_fetch_seconds",
+         "Wall-clock seconds of the last successful collection per source"),
+        ("fetch_ok", "epaper_source_fetch_ok",
+         "1 if the last collection of a source fetched fresh data"),
+        ("age_seconds", "epaper_source_age_seconds",
+         "Age of the data drawn per source"),
+    ]
+    for field, metric, help_text in source_gauges:
+        lines += ["# HELP {} {}".format(metric, help_text), "# TYPE {} gauge".format(metric)]
+        for source, stats in sorted(record["sources"].items()):
+            if stats.get(field) is not None:
+                lines.append('{}{{source="{}"}} {}'.format(metric, label(source), 
+                                                          float(stats[field])))
+    lines += [
+        "# HELP epaper_refreshes_total Refreshes since the process started, by outcome",
+        "# TYPE epaper_refreshes_total counter",
+    ]
+    for outcome, n in sorted(_outcomes.items()):
+        lines.append('epaper_refreshes_total{{outcome="{}"}} {}'.format(label(outcome), n))
+
+    os.makedirs(os.path.dirname(prometheus_textfile_path), exist_ok=True)
+    tmp_path = prometheus_textfile_path + ".tmp"
+    with open(tmp_path, "w") as f:
+        f.write("\n".join(lines) + "\n")
+    os.replace(tmp_path, prometheus_textfile_path)
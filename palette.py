@@ -0,0 +1,80 @@
+from PIL import Image
+
+##~~~~~~~~~~~~~~~~~
+## PANEL PALETTE
+## The 7 colours of the epd7in3f ACeP panel, in the order of
+## the panel's 4-bit colour indices (same as epd.getbuffer)
+
+panel_palette = [
+    ("black", (0, 0, 0)),
+    ("white", (255, 255, 255)),
+    ("green", (0, 255, 0)),
+    ("blue", (0, 0, 255)),
+    ("red", (255, 0, 0)),
+    ("yellow", (255, 255, 0)),
+    ("orange", (255, 128, 0)),
+]
+
+panel_index = {name: i for i, (name, _) in enumerate(panel_palette)}
+panel_rgb = {name: rgb for name, rgb in panel_palette}
+
+epap_model = "epd7in3f"
+
+_panel_colors = {}
+
+
+def panel_colors(debug=False, mode="RGB"):
+    """
+    Drawing colours by name. "P" mode canvases on the panel
+    palette draw with palette indices. For RGB, debug renders
+    use PIL colour names and on the panel the driver's constants
+    are read from the EPD once and reused for every call after
+    """
+    if mode == "P":
+        return panel_index
+    if debug not in _panel_colors:
+        if debug:
+            colors = {name: name for name, _ in panel_palette}
+        else:
+            import epaper
+            epd = epaper.epaper(epap_model).EPD()
+            colors = {name: getattr(epd, name.upper()) for name, _ in panel_palette}
+        _panel_colors[debug] = colors
+    return _panel_colors[debug]
+
+
+def new_panel_image(size, color="white"):
+    """
+    "P" mode image fixed to the panel palette, a third of
+    the memory of an RGB frame
+    """
+    image = Image.new("P", size, panel_index[color])
+    image.putpalette(palette_data())
+    return image
+
+
+def palette_data():
+    """
+    Flat 256 entry palette for putpalette, unused entries are black
+    """
+    data = []
+    for _, rgb in panel_palette:
+        data.extend(rgb)
+    return data + [0, 0, 0] * (256 - len(panel_palette))
+
+
+def palette_image():
+    """
+    1x1 "P" image carrying the panel palette, for quantize()
+    """
+    image = Image.new("P", (1, 1))
+    image.putpalette(palette_data())
+    return image
+
+
+def to_panel_colors(image):
+    """
+    Map an image onto the panel palette, same as the
+    conversion epd.getbuffer does on every frame
+    """
+    return image.convert("RGB").quantize(palette=palette_image())
@@ -0,0 +1,170 @@
+import json
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+from circuit_breaker import CircuitOpenError
+
+##~~~~~~~~~~~~~~~~~
+## ON-DISK RESPONSE CACHE
+## Decoded responses are kept as JSON files under cache_dir
+## so they survive reboots. Each entry has an expiry, after
+## which it can still be served for stale_ttl seconds while
+## a background thread fetches a fresh copy
+
+cache_dir = "./cache"
+
+_refreshing = set()
+_refreshing_lock = threading.Lock()
+_local = threading.local()
+
+
+def cache_path(key):
+    """
+    Return the file holding a cache entry
+    """
+    safe_key = "".join(c if c.isalnum() or c in "-_." else "_" for c in key)
+    return os.path.join(cache_dir, safe_key + ".json")
+
+
+def read_entry(key):
+    """
+    Return the stored entry for key, None if there isn't one
+    """
+    try:
+        with open(cache_path(key)) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def write_entry(key, data, expires_at):
+    """
+    Atomically store data under key with an expiry timestamp
+    """
+    os.makedirs(cache_dir, exist_ok=True)
+    entry = {"stored_at": time.time(), "expires_at": expires_at, "data": data}
+    path = cache_path(key)
+    tmp_path = "{}.{}.tmp".format(path, threading.get_ident())
+    with open(tmp_path, "w") as f:
+        json.dump(entry, f)
+    os.replace(tmp_path, path)
+
+
+def expiry_from_ttl(ttl, data):
+    """
+    ttl is either seconds from now or a function of the
+    fetched data returning the expiry timestamp
+    """
+    if callable(ttl):
+        return ttl(data)
+    return time.time() + ttl
+
+
+def until_next_business_day():
+    """
+    Expiry at midnight starting the next weekday
+    """
+    next_day = datetime.now().date() + timedelta(days=1)
+    while next_day.weekday() >= 5:
+        next_day = next_day + timedelta(days=1)
+    return datetime.combine(next_day, datetime.min.time()).timestamp()
+
+
+def refresh_entry(key, fetch, ttl):
+    """
+    Fetch and store a fresh copy of key
+    """
+    data = fetch()
+    ## an empty result, e.g. no AirNow observations overnight,
+    ## is still an answer worth caching
+    if data is not None:
+        write_entry(key, data, expiry_from_ttl(ttl, data))
+    return data
+
+
+@contextmanager
+def fetch_report():
+    """
+    Record the fetches of the cached_fetch calls made in the
+    block, and on threads started with carry_report. Yields
+    {"failed": [key, ...]}, the keys whose fetch failed, served
+    from an old copy or raised
+    """
+    previous = getattr(_local, "report", None)
+    report = {"failed": []}
+    _local.report = report
+    try:
+        yield report
+    finally:
+        _local.report = previous
+
+
+def carry_report(func):
+    """
+    Wrap func, to be run on another thread, so its fetches go
+    in the calling thread's fetch_report
+    """
+    report = getattr(_local, "report", None)
+
+    def run(*args, **kwargs):
+        previous = getattr(_local, "report", None)
+        _local.report = report
+        try:
+            return func(*args, **kwargs)
+        finally:
+            _local.report = previous
+    return run
+
+
+def _background_refresh(key, fetch, ttl):
+    try:
+        refresh_entry(key, fetch, ttl)
+    except CircuitOpenError as exception:
+        ## the breaker logged opening, once is enough
+        logging.debug("skipped refreshing cache entry %s: %s", key, exception)
+    except Exception:
+        logging.exception("FAIL refreshing cache entry %s", key)
+    finally:
+        with _refreshing_lock:
+            _refreshing.discard(key)
+
+
+def cached_fetch(key, fetch, ttl, stale_ttl=0):
+    """
+    Return the cached data for key while it is fresh. Within
+    stale_ttl of expiring, serve the stale copy and refresh it
+    in the background. Otherwise fetch now, falling back to
+    any old copy if the fetch fails. None isn't cached
+    """
+    entry = read_entry(key)
+    now = time.time()
+
+    if entry is not None and now < entry["expires_at"]:
+        return entry["data"]
+
+    if entry is not None and now < entry["expires_at"] + stale_ttl:
+        with _refreshing_lock:
+            start = key not in _refreshing
+            _refreshing.add(key)
+        if start:
+            threading.Thread(target=_background_refresh, args=(key, fetch, ttl),
+                             daemon=True).start()
+        return entry["data"]
+
+    try:
+        return refresh_entry(key, fetch, ttl)
+    except Exception as exception:
+        report = getattr(_local, "report", None)
+        if report is not None:
+            report["failed"].append(key)
+        if entry is None:
+            raise
+        stored_at = datetime.fromtimestamp(entry["stored_at"])
+        if isinstance(exception, CircuitOpenError):
+            logging.debug("%s breaker open, using copy from %s", key, stored_at)
+        else:
+            logging.exception("FAIL fetching %s, using copy from %s", key, stored_at)
+        return entry["data"]
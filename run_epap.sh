@@ -1,10 +1,15 @@
 #!/bin/bash
 
-sleep 30
+## no fixed sleep, display.py waits for the SPI device and
+## the network itself (readiness_timeout)
 
 cd /home/amos
 source epap/bin/activate
 cd Desktop/weather_epaper/
+
+## build the palette-native icon pack if it isn't there yet
+[ -f icons/icons.pack ] || python build_icon_pack.py
+
 python display.py
 
 /bin/bash
\ No newline at end of file
@@ -0,0 +1,163 @@
+import logging
+import signal
+import threading
+from datetime import datetime, timedelta
+
+##~~~~~~~~~~~~~~~~~
+## REFRESH SCHEDULER
+## Sleeps until the next job is due instead of polling every
+## second. Jobs run one at a time on a worker thread and are
+## given up on after their timeout. Quiet hours are a window in
+## which the jobs that would update the panel are skipped,
+## rather than a sleep that blocks everything else
+
+## wake at least this often (seconds) in case the clock jumps,
+## e.g. NTP setting it after boot
+max_sleep = 5*60
+
+
+def hourly_at(*minutes):
+    """
+    Next run at any of minutes past the hour
+    """
+    def next_run(now):
+        base = now.replace(second=0, microsecond=0)
+        candidates = [base.replace(minute=m) for m in minutes]
+        candidates += [c + timedelta(hours=1) for c in candidates]
+        return min(c for c in candidates if c > now)
+    return next_run
+
+
+def daily_at(clock):
+    """
+    Next run at clock time "HH:MM" every day
+    """
+    hour, minute = (int(part) for part in clock.split(":"))
+    def next_run(now):
+        candidate = now.replace(hour=hour, minute=minute, second=0, microsecond=0)
+        if candidate <= now:
+            candidate += timedelta(days=1)
+        return candidate
+    return next_run
+
+
+class Job:
+
+    def __init__(self, name, func, when, timeout, during_quiet_hours=False):
+        self.name = name
+        self.func = func
+        self.when = when
+        self.timeout = timeout
+        self.during_quiet_hours = during_quiet_hours
+        self.next_run = None
+
+
+class Scheduler:
+
+    def __init__(self, quiet_hours=None):
+        self.jobs = []
+        self.quiet_hours = quiet_hours
+        self.quiet_cancelled = None
+        self.wake = threading.Event()
+        self.stopping = False
+        self.run_now = set()
+        self.worker = None
+
+    def add(self, job):
+        job.next_run = job.when(datetime.now())
+        self.jobs.append(job)
+
+    ##~~~~~~~~~~~~~~~~~
+    ## Quiet hours
+
+    def quiet_window(self, now):
+        """
+        Start of the quiet hours window now falls in, None
+        outside of quiet hours
+        """
+        if self.quiet_hours is None:
+            return None
+        start = daily_at(self.quiet_hours[0])(now) - timedelta(days=1)
+        end = daily_at(self.quiet_hours[1])(start)
+        if start <= now < end:
+            return start
+        return None
+
+    def in_quiet_hours(self, now):
+        window = self.quiet_window(now)
+        return window is not None and window != self.quiet_cancelled
+
+    ##~~~~~~~~~~~~~~~~~
+    ## Signals, safe to call from handlers
+
+    def request(self, name):
+        """
+        Run a job now, ending tonight's quiet hours
+        """
+        self.quiet_cancelled = self.quiet_window(datetime.now())
+        self.run_now.add(name)
+        self.wake.set()
+
+    def stop(self):
+        self.stopping = True
+        self.wake.set()
+
+    def install_signal_handlers(self, refresh_job):
+        """
+        SIGUSR1 runs refresh_job now, SIGTERM and SIGINT stop
+        the scheduler after the running job
+        """
+        signal.signal(signal.SIGUSR1, lambda signum, frame: self.request(refresh_job))
+        signal.signal(signal.SIGTERM, lambda signum, frame: self.stop())
+        signal.signal(signal.SIGINT, lambda signum, frame: self.stop())
+
+    ##~~~~~~~~~~~~~~~~~
+    ## Running jobs
+
+    def run_job(self, job):
+        """
+        Run a job on the worker thread and wait for it up to
+        its timeout. Nothing else runs while it is still going
+        """
+        if self.worker is not None and self.worker.is_alive():
+            logging.warning("skipping %s, %s is still running", job.name, self.worker.name)
+            return
+
+        def target():
+            try:
+                job.func()
+            except Exception:
+                logging.exception("FAIL in scheduled job %s", job.name)
+
+        self.worker = threading.Thread(target=target, name=job.name, daemon=True)
+        self.worker.start()
+        self.worker.join(job.timeout)
+        if self.worker.is_alive():
+            logging.error("%s timed out after %d s, giving up on it", job.name, job.timeout)
+
+    def run(self):
+        """
+        Run jobs as they come due until stopped
+        """
+        jobs = {job.name: job for job in self.jobs}
+        while not self.stopping:
+            ## a signal from here on wakes the next wait straight away
+            self.wake.clear()
+            requested, self.run_now = self.run_now, set()
+            now = datetime.now()
+            due = [job for job in self.jobs if job.next_run <= now]
+            due += [jobs[name] for name in requested if jobs[name] not in due]
+
+            for job in due:
+                if self.stopping:
+                    break
+                job.next_run = job.when(datetime.now())
+                if (self.in_quiet_hours(now) and not job.during_quiet_hours
+                        and job.name not in requested):
+                    logging.info("quiet hours, skipping %s", job.name)
+                    continue
+                self.run_job(job)
+
+            next_run = min(job.next_run for job in self.jobs)
+            sleep = (next_run - datetime.now()).total_seconds()
+            self.wake.wait(min(max(sleep, 0), max_sleep))
@@ -0,0 +1,144 @@
+import logging
+import os
+from framebuffer import pack_frame, numpy_available
+from frame_server import publish_frame
+from memwatch import memory_stage
+from metrics import timed
+from palette import new_panel_image, epap_model
+
+##~~~~~~~~~~~~~~~~~
+## OUTPUT SINKS
+## Where a location profile's frames go. A sink spec of "epd"
+## is the e-paper panel on this Pi, "file:<path>" saves each
+## frame as a PNG for a panel driven from somewhere else and
+## "http" serves it from the frame server (frame_server.py)
+
+_panel = None
+
+
+class PanelSink:
+    """
+    The Waveshare panel on this Pi. The driver is created on
+    first use so importing this module doesn't wait on the
+    epaper package or the panel
+    """
+
+    def __init__(self, size, packer="numpy"):
+        self.size = size
+        self.packer = packer
+        self.epd = None
+        self.epaper = None
+
+    def open(self):
+        if self.epd is None:
+            import epaper
+            self.epaper = epaper
+            self.epd = epaper.epaper(epap_model).EPD()
+        return self.epd
+
+    def frame_buffer(self, image):
+        """
+        Pack a frame for epd.display with the configured packer,
+        falling back to getbuffer if numpy isn't installed
+        """
+        if self.packer == "numpy" and numpy_available():
+            return pack_frame(image, *self.size)
+        return self.open().getbuffer(image)
+
+    def send(self, image):
+        """
+        Wake the panel and show a frame
+        """
+        with memory_stage("buffer"), timed("buffer"):
+            frame_buffer = self.frame_buffer(image)
+        with memory_stage("display"), timed("display"):
+            epd = self.open()
+            epd.init()
+            epd.Clear()
+            epd.display(frame_buffer)
+
+    def clear(self):
+        epd = self.open()
+        epd.init()
+        epd.Clear()
+
+    def close(self):
+        """
+        Release the panel's pins
+        """
+        if self.epd is not None:
+            self.epaper.epaper(epap_model).epdconfig.module_exit(cleanup=True)
+
+
+class FileSink:
+    """
+    Frames saved to path, replaced atomically so a reader
+    never sees half a file
+    """
+
+    def __init__(self, path, size):
+        self.path = path
+        self.size = size
+
+    def send(self, image):
+        with timed("save frame"):
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            tmp_path = self.path + ".tmp"
+            image.save(tmp_path, format="PNG")
+            os.replace(tmp_path, self.path)
+
+    def clear(self):
+        self.send(new_panel_image(self.size))
+
+    def close(self):
+        pass
+
+
+class ServedSink:
+    """
+    Frames published on the frame server under name
+    """
+
+    def __init__(self, name, size):
+        self.name = name
+        self.size = size
+
+    def send(self, image):
+        with timed("publish frame"):
+            publish_frame(self.name, image)
+
+    def clear(self):
+        self.send(new_panel_image(self.size))
+
+    def close(self):
+        pass
+
+
+def make_sink(spec, size, packer="numpy", name=None):
+    """
+    Sink for a profile's sink spec, name is the profile's.
+    Every "epd" profile shares the one panel
+    """
+    global _panel
+    if spec == "epd":
+        if _panel is None:
+            _panel = PanelSink(size, packer)
+        return _panel
+    if spec.startswith("file:"):
+        return FileSink(spec[len("file:"):], size)
+    if spec == "http":
+        return ServedSink(name, size)
+    raise ValueError("unknown sink {!r}, expected \"epd\", \"file:<path>\" or \"http\"".format(spec))
+
+
+def close_sinks(sinks):
+    """
+    Close every sink once, logging failures
+    """
+    for sink in set(sinks):
+        try:
+            sink.close()
+        except Exception:
+            logging.exception("FAIL closing %s", type(sink).__name__)
@@ -0,0 +1,205 @@
+import json
+import logging
+import os
+import threading
+import time
+from functools import partial
+from response_cache import fetch_report
+
+##~~~~~~~~~~~~~~~~~
+## SNAPSHOT STORE
+## Latest payload of every data source, in memory and on disk
+## so a restart can draw straight away. A snapshot keeps the
+## time its payload was first seen, so a source stuck on an old
+## copy (cache fallback, open breaker) shows its real age
+
+snapshot_path = "./cache/snapshots.json"
+
+_snapshots = {}
+_snapshots_lock = threading.Lock()
+_loaded = False
+
+
+def load_snapshots():
+    """
+    Read the snapshots saved by an earlier run, once
+    """
+    global _loaded
+    with _snapshots_lock:
+        if _loaded:
+            return
+        _loaded = True
+        try:
+            with open(snapshot_path) as f:
+                _snapshots.update(json.load(f))
+        except (OSError, ValueError):
+            pass
+
+
+def save_snapshots():
+    """
+    Atomically write every snapshot to disk
+    """
+    os.makedirs(os.path.dirname(snapshot_path), exist_ok=True)
+    with _snapshots_lock:
+        text = json.dumps(_snapshots)
+    tmp_path = "{}.{}.tmp".format(snapshot_path, threading.get_ident())
+    with open(tmp_path, "w") as f:
+        f.write(text)
+    os.replace(tmp_path, snapshot_path)
+
+
+def put_snapshot(source, data):
+    """
+    Store a source's latest payload. fetched_at only moves
+    when the payload changes, so a payload has to carry what
+    makes it new, e.g. the pollen page's date
+    """
+    load_snapshots()
+    now = time.time()
+    with _snapshots_lock:
+        snapshot = _snapshots.get(source)
+        if snapshot is not None and snapshot["data"] == data:
+            snapshot["checked_at"] = now
+        else:
+            _snapshots[source] = {"data": data, "fetched_at": now, "checked_at": now}
+    save_snapshots()
+
+
+def latest_snapshots():
+    """
+    Latest snapshot of every source collected so far, as
+    {source: {"data", "fetched_at", "checked_at"}}
+    """
+    load_snapshots()
+    with _snapshots_lock:
+        return {source: dict(snapshot) for source, snapshot in _snapshots.items()}
+
+
+##~~~~~~~~~~~~~~~~~
+## BACKGROUND COLLECTOR
+## One thread per source refreshes its snapshot on the
+## source's own interval, so rendering never waits on the
+## network. Fetch functions go through the response cache
+## and circuit breakers as before
+
+## seconds between collections, in line with the cache ttls.
+## Sources are looked up by kind, "weather@29.8,-95.4" is a
+## "weather" source
+collect_intervals = {
+    "weather": 10*60,
+    "air_quality": 30*60,
+    "pollen": 60*60,
+}
+collect_interval_default = 30*60
+
+## wait before trying again after a failed collection
+collect_retry = 2*60
+
+_collector_stop = threading.Event()
+_collector_threads = []
+
+## last collection of each source, {"seconds", "ok", "at"}, for
+## the refresh metrics now that fetches are off the refresh.
+## seconds is the last successful collection's
+_fetch_stats = {}
+
+
+def collect_source(name, fetch):
+    """
+    Fetch one source into the store, True on success. A fetch
+    the response cache answered with an old copy is stored but
+    counts as failed
+    """
+    start = time.perf_counter()
+    with fetch_report() as report:
+        try:
+            data = fetch()
+        except Exception:
+            logging.exception("FAIL collecting %s data", name)
+            data = None
+    seconds = time.perf_counter() - start
+    ok = data is not None and not report["failed"]
+    with _snapshots_lock:
+        last = _fetch_stats.get(name, {})
+        _fetch_stats[name] = {"seconds": seconds if ok else last.get("seconds"),
+                              "ok": ok, "at": time.time()}
+    if data is not None:
+        put_snapshot(name, data)
+    return ok
+
+
+def collect_once(sources, run_all):
+    """
+    Collect every source now, {name: fetch function}. run_all
+    runs {name: function} and returns once they're done or it
+    stops waiting, e.g. dashboard_data.fetch_sources
+    """
+    run_all({name: partial(collect_source, name, fetch) for name, fetch in sources.items()})
+
+
+def _collect_loop(name, fetch):
+    interval = collect_intervals.get(name.split("@", 1)[0], collect_interval_default)
+
+    ## a snapshot from before a restart may still be fresh
+    snapshot = latest_snapshots().get(name)
+    delay = 0
+    if snapshot is not None:
+        delay = max(0, snapshot["checked_at"] + interval - time.time())
+
+    while not _collector_stop.wait(delay):
+        delay = interval if collect_source(name, fetch) else collect_retry
+
+
+def start_collector(sources):
+    """
+    Start collecting each of sources, {name: fetch function},
+    in the background
+    """
+    if collector_running():
+        return
+    _collector_stop.clear()
+    for name, fetch in sources.items():
+        thread = threading.Thread(target=_collect_loop, args=(name, fetch),
+                                  name="collect-"+name, daemon=True)
+        thread.start()
+        _collector_threads.append(thread)
+
+
+def source_metrics(sources=None, now=None):
+    """
+    Last collection and data age of each source (every
+    collected one by default), as metrics.note_sources takes
+    """
+    now = time.time() if now is None else now
+    snapshots = latest_snapshots()
+    with _snapshots_lock:
+        stats = {name: dict(stat) for name, stat in _fetch_stats.items()}
+    if sources is None:
+        sources = sorted(set(snapshots) | set(stats))
+
+    metrics = {}
+    for name in sources:
+        stat = stats.get(name, {})
+        snapshot = snapshots.get(name)
+        metrics[name] = {
+            "fetch_seconds": None if stat.get("seconds") is None else round(stat["seconds"], 4),
+            "fetch_ok": None if not stat else int(stat["ok"]),
+            "age_seconds": None if snapshot is None else round(now - snapshot["fetched_at"], 1),
+        }
+    return metrics
+
+
+def collector_running():
+    return any(thread.is_alive() for thread in _collector_threads)
+
+
+def stop_collector(timeout=5):
+    """
+    Stop the collector threads, a fetch in flight is
+    left to finish on its own timeout
+    """
+    _collector_stop.set()
+    for thread in _collector_threads:
+        thread.join(timeout)
+    _collector_threads.clear()
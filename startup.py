@@ -0,0 +1,120 @@
+import json
+import logging
+import os
+import socket
+import time
+
+##~~~~~~~~~~~~~~~~~
+## STARTUP
+## Readiness probe run in place of a fixed sleep at boot: wait
+## until the panel's SPI device exists and the network can reach
+## a data source, up to a timeout. Startup milestones are timed
+## from boot so time-to-first-frame can be tracked
+
+spi_device = "/dev/spidev0.0"
+network_probe_host = "api.openweathermap.org"
+network_probe_port = 443
+probe_interval = 0.5
+
+## one JSON object per start, next to the refresh metrics
+startup_report_path = "./metrics/startup.jsonl"
+
+_marks = []
+
+
+def seconds_since_boot():
+    """
+    Uptime in seconds, or time since this module was
+    imported where /proc isn't available
+    """
+    try:
+        with open("/proc/uptime") as f:
+            return float(f.read().split()[0])
+    except (OSError, ValueError, IndexError):
+        return time.monotonic() - _import_clock
+
+
+def process_started_since_boot():
+    """
+    When this process started, in seconds after boot
+    """
+    try:
+        with open("/proc/self/stat") as f:
+            ## the command name can hold spaces, fields follow its ")"
+            fields = f.read().rsplit(")", 1)[1].split()
+        return int(fields[19]) / os.sysconf("SC_CLK_TCK")
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+def mark(name):
+    """
+    Record a startup milestone
+    """
+    _marks.append((name, seconds_since_boot()))
+
+
+def spi_ready():
+    return os.path.exists(spi_device)
+
+
+def network_ready(timeout=2):
+    """
+    Whether a data source host resolves and accepts a connection
+    """
+    try:
+        with socket.create_connection((network_probe_host, network_probe_port), timeout=timeout):
+            return True
+    except OSError:
+        return False
+
+
+def wait_until_ready(timeout, need_spi=True):
+    """
+    Wait for the SPI device and the network, up to timeout
+    seconds. Returns whether both came up, the dashboard starts
+    either way and draws what it has
+    """
+    deadline = time.monotonic() + timeout
+    spi_up = not need_spi
+    network_up = False
+    while True:
+        spi_up = spi_up or spi_ready()
+        network_up = network_up or network_ready(timeout=max(0.1, min(2, deadline - time.monotonic())))
+        if spi_up and network_up:
+            return True
+        if time.monotonic() >= deadline:
+            logging.warning("not ready after %d s: spi %s, network %s",
+                            timeout, "up" if spi_up else "down", "up" if network_up else "down")
+            return False
+        time.sleep(probe_interval)
+
+
+def report_startup():
+    """
+    Log the time from boot to each milestone and append
+    the report to startup_report_path
+    """
+    started = process_started_since_boot()
+    report = {"time": round(time.time(), 3),
+              "process_start": None if started is None else round(started, 2)}
+    previous = started
+    steps = []
+    for name, since_boot in _marks:
+        report[name] = round(since_boot, 2)
+        if previous is not None:
+            steps.append("{} +{:.2f} s".format(name, since_boot - previous))
+        previous = since_boot
+
+    logging.info("startup: process started %s s after boot, %s",
+                 report["process_start"], ", ".join(steps))
+    try:
+        os.makedirs(os.path.dirname(startup_report_path), exist_ok=True)
+        with open(startup_report_path, "a") as f:
+            f.write(json.dumps(report) + "\n")
+    except OSError:
+        logging.exception("FAIL writing startup report")
+    return report
+
+
+_import_clock = time.monotonic()
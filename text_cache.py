@@ -0,0 +1,119 @@
+from PIL import Image, ImageDraw
+from collections import OrderedDict
+import math
+import threading
+
+##~~~~~~~~~~~~~~~~~
+## TEXT RUN CACHE
+## Labels and numerals are rasterized by FreeType once per
+## (text, font, anchor, stroke) and kept as masks, later draws
+## paste the masks in the requested colours. Masks are made by
+## draw.text itself, so cached text is pixel-identical to it.
+## Least recently used runs are dropped past text_cache_budget
+
+text_cache_enabled = True
+text_cache_budget = 1024*1024
+
+_text_cache = OrderedDict()
+_text_cache_bytes = 0
+_text_cache_lock = threading.Lock()
+
+
+def fontmode_for(image):
+    """
+    Text on palette frames is drawn without antialiasing,
+    same as display.new_draw
+    """
+    return "1" if image.mode == "P" else "L"
+
+
+def render_text_run(text, font, anchor, stroke_width, fontmode):
+    """
+    Rasterize a text run into (offset, stroke mask, fill mask),
+    offset is the top left of the masks relative to the text's
+    xy. The stroke mask is None for unstroked text
+    """
+    measure = ImageDraw.Draw(Image.new("L", (1, 1)))
+    measure.fontmode = fontmode
+    left, top, right, bottom = measure.textbbox((0, 0), text, font=font, anchor=anchor,
+                                                stroke_width=stroke_width)
+    left, top = math.floor(left) - 1, math.floor(top) - 1
+    size = (math.ceil(right) - left + 1, math.ceil(bottom) - top + 1)
+
+    def mask(fill, stroke_fill):
+        scratch = Image.new("L", size, 0)
+        draw = ImageDraw.Draw(scratch)
+        draw.fontmode = fontmode
+        draw.text((-left, -top), text, font=font, fill=fill, anchor=anchor,
+                  stroke_width=stroke_width, stroke_fill=stroke_fill)
+        return scratch
+
+    ## a stroke the same colour as the fill is drawn alone, and a
+    ## black stroke leaves only the fill on the scratch image
+    fill_mask = mask(255, 0)
+    stroke_mask = mask(255, 255) if stroke_width else None
+
+    box = (stroke_mask or fill_mask).getbbox()
+    if box is None:
+        return (0, 0), None, None
+    fill_mask = fill_mask.crop(box)
+    if stroke_mask is not None:
+        stroke_mask = stroke_mask.crop(box)
+    return (left + box[0], top + box[1]), stroke_mask, fill_mask
+
+
+def get_text_run(text, font, anchor, stroke_width, fontmode):
+    """
+    Cached render_text_run, least recently used runs are
+    dropped once the cache is over its budget
+    """
+    global _text_cache_bytes
+    key = (text, getattr(font, "path", None), font.size, anchor, stroke_width, fontmode)
+    with _text_cache_lock:
+        run = _text_cache.get(key)
+        if run is not None:
+            _text_cache.move_to_end(key)
+            return run
+
+    run = render_text_run(text, font, anchor, stroke_width, fontmode)
+    run_bytes = sum(m.width * m.height for m in run[1:] if m is not None)
+
+    with _text_cache_lock:
+        if key not in _text_cache:
+            _text_cache[key] = run
+            _text_cache_bytes += run_bytes
+            while _text_cache_bytes > text_cache_budget and len(_text_cache) > 1:
+                _, old = _text_cache.popitem(last=False)
+                _text_cache_bytes -= sum(m.width * m.height for m in old[1:] if m is not None)
+    return run
+
+
+def draw_text(image, xy, text, font, fill, anchor=None, stroke_width=0, stroke_fill=None):
+    """
+    Same as ImageDraw.text on image, from the text run cache
+    """
+    if not text_cache_enabled or not all(isinstance(c, int) for c in xy):
+        draw = ImageDraw.Draw(image)
+        draw.fontmode = fontmode_for(image)
+        draw.text(xy, text, font=font, fill=fill, anchor=anchor,
+                  stroke_width=stroke_width, stroke_fill=stroke_fill)
+        return
+
+    (dx, dy), stroke_mask, fill_mask = get_text_run(text, font, anchor, stroke_width,
+                                                    fontmode_for(image))
+    if fill_mask is None:
+        return
+    origin = (xy[0] + dx, xy[1] + dy)
+    if stroke_mask is not None:
+        stroke_fill = fill if stroke_fill is None else stroke_fill
+        image.paste(stroke_fill, origin, stroke_mask)
+        if stroke_fill == fill:
+            return
+    image.paste(fill, origin, fill_mask)
+
+
+def clear_text_cache():
+    global _text_cache_bytes
+    with _text_cache_lock:
+        _text_cache.clear()
+        _text_cache_bytes = 0